@@ -20,11 +20,14 @@ bl_info = {
 }
 
 modulesNames = [
+    'utils.context_helpers',
     'utils.math_helpers',
     'utils.mesh_helpers',
     'utils.message_helpers',
     'utils.collection_helpers',
     'utils.uv_helpers',
+    'utils.timing_helpers',
+    'utils.datablock_helpers',
     'utils.vehicle_checks',
     'ui.ui_auto_uv_panel',
     'ui.ui_rush_hour_panel',
@@ -6,7 +6,9 @@ import bpy
 import os
 import json
 
+from ..utils import context_helpers
 from ..utils import mesh_helpers
+from ..utils import timing_helpers
 
 import logging
 
@@ -14,28 +16,35 @@ log = logging.getLogger(__name__)
 
 
 def export_skeletal_fbx_selected(filepath: str):
-    bpy.ops.export_scene.fbx(filepath=filepath, check_existing=False, mesh_smooth_type='FACE',
-                             use_selection=True, add_leaf_bones=False, path_mode='COPY', embed_textures=False)
+    with timing_helpers.stage("export_fbx:" + os.path.basename(filepath), bpy.context.selected_objects):
+        bpy.ops.export_scene.fbx(filepath=filepath, check_existing=False, mesh_smooth_type='FACE',
+                                 use_selection=True, add_leaf_bones=False, path_mode='COPY', embed_textures=False)
+        timing_helpers.count_ops_calls()
 
 
 def export_static_fbx_selected(filepath: str):
-    bpy.ops.export_scene.fbx(filepath=filepath, check_existing=False, mesh_smooth_type='FACE',
-                             use_active_collection=False, use_selection=True, path_mode='COPY',
-                             embed_textures=True)
+    with timing_helpers.stage("export_fbx:" + os.path.basename(filepath), bpy.context.selected_objects):
+        bpy.ops.export_scene.fbx(filepath=filepath, check_existing=False, mesh_smooth_type='FACE',
+                                 use_active_collection=False, use_selection=True, path_mode='COPY',
+                                 embed_textures=True)
+        timing_helpers.count_ops_calls()
 
 
 def export_static_usd_selected(filepath: str):
     bpy.ops.wm.usd_export(filepath=filepath, check_existing=False, selected_objects_only=True, overwrite_textures=True,
                           export_textures=True)
+    timing_helpers.count_ops_calls()
 
 
 def export_static_gltf_selected(filepath: str):
     bpy.ops.export_scene.gltf(filepath=filepath, check_existing=False, use_selection=True)
+    timing_helpers.count_ops_calls()
 
 
 def export_skeletal_usd_selected(filepath: str):
     bpy.ops.wm.usd_export(filepath=filepath, check_existing=False, selected_objects_only=True, overwrite_textures=False,
                           export_textures=False, export_materials=False)
+    timing_helpers.count_ops_calls()
 
 
 def export_vehicle_static_meshes(context, scene_filename: str, export_dir: str, export_format: str = "usd"):
@@ -59,7 +68,7 @@ def export_vehicle_static_meshes(context, scene_filename: str, export_dir: str,
     ############
 
     # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
+    context_helpers.select_only(context, [])
 
     # Get the export collection
     export_collection = bpy.data.collections["export"]
@@ -85,7 +94,7 @@ def export_vehicle_static_meshes(context, scene_filename: str, export_dir: str,
         export_static_usd_selected(filepath=static_mesh_filename)
 
     # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
+    context_helpers.select_only(context, [])
 
     exported_files = [static_mesh_filename]
 
@@ -103,7 +112,7 @@ def export_vehicle_skeletal_meshes(context, scene_filename, export_dir, export_f
     exported_meshes = []
 
     # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
+    context_helpers.select_only(context, [])
 
     # Get the export collection
     export_collection = bpy.data.collections["export"]
@@ -306,7 +315,8 @@ def export_process(context):
     exported_sk_files, exported_skeletal_meshes = export_vehicle_skeletal_meshes(context, scene_filename, export_dir, export_format="fbx")
     exported_sk_files = [os.path.basename(x) for x in exported_sk_files]
 
-    write_export_json(exported_static_meshes, exported_sm_files, exported_skeletal_meshes, exported_sk_files, scene_filename, export_dir)
+    with timing_helpers.stage("write_export_json"):
+        write_export_json(exported_static_meshes, exported_sm_files, exported_skeletal_meshes, exported_sk_files, scene_filename, export_dir)
 
     # Restore visibility states after export
     for item in original_visibilities:
@@ -317,6 +327,11 @@ def export_process(context):
         else:
             item.hide_set(visibility)
 
+    # Write the stage timings next to the export manifest when the export is part of an instrumented run
+    ledger = timing_helpers.get_active_ledger()
+    if ledger is not None:
+        ledger.write(export_dir, scene_filename)
+
     print("Vehicle Export Complete")
 
 
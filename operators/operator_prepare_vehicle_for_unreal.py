@@ -3,9 +3,20 @@
 # https://choosealicense.com/licenses/mit/
 
 import bpy
+import numpy as np
+from mathutils import Matrix, Vector
 
 from ..utils import collection_helpers
+from ..utils import context_helpers
+from ..utils import datablock_helpers
 from ..utils import mesh_helpers
+from ..utils import timing_helpers
+from ..utils import uv_helpers
+from . import operator_scale_UV_worldspace
+
+
+# Tolerance used when checking that wheel parts are exact copies of each other
+WHEEL_INSTANCE_TOLERANCE = 1e-3
 
 
 # Create proxy mesh with single tiny triangle at 0,0,0.
@@ -24,123 +35,48 @@ def create_proxy_mesh():
 
     return mesh_obj
 
-def ensure_custom_weights_exist(obj):
-    if bpy.app.version >= (4, 0, 0):
-        if "bevel_weight_vert" not in obj.data.attributes:
-            obj.data.attributes.new(name="bevel_weight_vert", type='FLOAT', domain='POINT')
-        if "bevel_weight_edge" not in obj.data.attributes:
-            obj.data.attributes.new(name="bevel_weight_edge", type='FLOAT', domain='EDGE')
-        if "crease_vertex" not in obj.data.attributes:
-            obj.data.attributes.new(name="crease_vertex", type='FLOAT', domain='POINT')
-        if "crease_edge" not in obj.data.attributes:
-            obj.data.attributes.new(name="crease_edge", type='FLOAT', domain='EDGE')
-    elif bpy.app.version >= (3, 4, 0):
-        # if blender 3.4 or newer, use the new operator
-        if not obj.data.has_bevel_weight_vertex:
-            bpy.ops.mesh.customdata_bevel_weight_vertex_add()
-        if not obj.data.has_bevel_weight_edge:
-            bpy.ops.mesh.customdata_bevel_weight_edge_add()
-        if not obj.data.has_crease_vertex:
-            bpy.ops.mesh.customdata_crease_vertex_add()
-        if not obj.data.has_crease_edge:
-            bpy.ops.mesh.customdata_crease_edge_add()
-    else:
-        # Older versions
-        obj.data.use_customdata_vertex_bevel = True
-        obj.data.use_customdata_edge_bevel = True
-        obj.data.use_customdata_edge_crease = True
+def merge_objects(context, objects, new_name, ledger=None):
+    meshes = [obj for obj in objects if obj.type == "MESH"]
+    if not meshes:
+        return []
 
-def merge_objects(context, objects, new_name):
-    # Deselect any objects that might still be selected
-    bpy.ops.object.select_all(action='DESELECT')
+    if ledger is None:
+        mesh_helpers.apply_all_modifiers(context, meshes)
+        applied_steps = set()
+    else:
+        # Only apply modifiers to meshes that haven't been through that step already
+        mesh_helpers.apply_all_modifiers(context, ledger.pending(meshes, ledger.MODIFIERS))
+        ledger.mark_applied(meshes, ledger.MODIFIERS)
+        applied_steps = ledger.get_steps_applied_to_all(meshes)
+        ledger.forget(meshes)
 
-    # Apply split normals to resolve any issue with auto-smoothing differences between meshes
-    # Split the normals to ensure that surfaces aren't messed up during the merge process
-    for obj in objects:
-        print("obj: ", obj.name, obj.type)
-        if obj.type == "MESH":
-            obj.select_set(True)
-            mesh_helpers.apply_all_modifiers(context, [obj])
-            ensure_custom_weights_exist(obj)
-            mesh_helpers.apply_split_normals(obj)
-            obj.select_set(False)
-
-    # Select all meshes in preparation for join operation
-    for obj in objects:
-        print("obj: ", obj.name, obj.type)
-        if obj.type == "MESH":
-            obj.select_set(True)
-            bpy.context.view_layer.objects.active = obj
+    # Merge everything into the last mesh, the same object the join operator would have used as active.
+    # Loop normals are baked as custom split normals so auto-smoothing differences between meshes
+    # don't change the surfaces. Only the material slots faces use are kept, one per material.
+    target_object = mesh_helpers.merge_meshes_into(context, meshes[-1], meshes)
 
-    # Join meshes in collection
-    bpy.ops.object.join()
+    # The merged mesh has had every step that was applied to all of its parts
+    if ledger is not None:
+        for step in applied_steps:
+            ledger.mark_applied([target_object], step)
 
-    # get the currently selected meshes
-    new_objects = bpy.context.selected_objects
-    for new_obj in new_objects:
-        # Disable auto worldspace uv
-        new_obj.enable_auto_uv = False
+    # Disable auto worldspace uv
+    target_object.enable_auto_uv = False
 
-    bpy.ops.object.select_all(action='DESELECT')
-    for curr_object in new_objects:
-        recenter_object_origin(curr_object)
+    recenter_object_origin(target_object)
 
     # Change object name to collection name, for consistency
-    for obj in new_objects:
-        obj.name = new_name
-
-    for obj in new_objects:
-        deduplicate_material_slots(obj)
+    target_object.name = new_name
 
-    return new_objects
+    return [target_object]
 
 
 def recenter_object_origin(target_object):
-    """Applies all transforms and then sets the object origin to the center of the geometry."""
-    bpy.ops.object.select_all(action='DESELECT')
-    target_object.select_set(True)
-    bpy.context.view_layer.objects.active = target_object
-
-    # Set the origin to the geometry
-    bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY', center='BOUNDS')
-    target_object.select_set(False)
-
-
-def deduplicate_material_slots(target_object):
-    # deselect all objects
-    bpy.ops.object.select_all(action='DESELECT')
-    # select object
-    target_object.select_set(True)
-    # for each material slot in object, find duplicates and remove them, assigning all faces to the first slot
-    # This used to not be enumerated as Blender offers slot_index in MaterialSlot struct in later versions.
-    # For now enumerate is used to support older versions
-    for slot1idx, slot in enumerate(target_object.material_slots):
-        for slot2idx, slot2 in enumerate(target_object.material_slots):
-            if slot1idx == slot2idx:
-                # Skip the same slot
-                continue
-            if slot.material == slot2.material:
-                # Assign all faces that have this slot to the first slot
-                for poly in target_object.data.polygons:
-                    if poly.material_index == slot2idx:
-                        poly.material_index = slot1idx
-
-    # Remove all unused slots
-    bpy.ops.object.material_slot_remove_unused()
-
-    # deselect object
-    target_object.select_set(False)
-
-
-def prep_collection(context, collection, new_parent_collection):
-    if collection.hide_render:
-        # Skip this collection as it's likely booleans and other stuff that we don't want
-        return
+    """Sets the object origin to the center of the geometry bounds."""
+    mesh_helpers.set_origin_to_bounds_center(target_object)
 
-    if collection.name in ["prepped", "wheels"]:
-        # Skip this collection as these are special groups
-        return
 
+def get_collection_objects_to_process(collection):
     objects_to_process = []
     for obj in collection.all_objects:
         if obj.type == "CAMERA":
@@ -153,148 +89,218 @@ def prep_collection(context, collection, new_parent_collection):
             # Don't operate on objects without data
             continue
         objects_to_process.append(obj)
+    return objects_to_process
+
+
+def prep_collection(context, collection, new_parent_collection, ledger=None):
+    if collection.hide_render:
+        # Skip this collection as it's likely booleans and other stuff that we don't want
+        return
+
+    if collection.name in ["prepped", "wheels"]:
+        # Skip this collection as these are special groups
+        return
 
-    new_objects = prep_objects(context, objects_to_process, collection.name, new_parent_collection)
+    objects_to_process = get_collection_objects_to_process(collection)
+
+    new_objects = prep_objects(context, objects_to_process, collection.name, new_parent_collection, ledger)
 
     return new_objects
 
 
-def prep_objects(context, objects, new_name, new_parent_collection):
-    new_objs = []
+def process_objects(context, objects, new_name, new_parent_collection, ledger=None):
+    """Duplicates the mesh objects and applies modifiers, transforms and worldspace UVs to the copies.
+    The steps applied are recorded in the ledger, so later stages don't apply them again.
+    Returns the processed copies, in the same order as the mesh objects they were copied from"""
+    if ledger is None:
+        ledger = mesh_helpers.ProcessingLedger()
 
-    bpy.ops.object.select_all(action='DESELECT')
+    new_objs = []
 
-    # for each object in collection
+    # Build every copy straight from its evaluated object, with the modifiers and world transform already baked in,
+    # so the original mesh is never duplicated before the modifiers are applied
+    depsgraph = context.evaluated_depsgraph_get()
     for obj in objects:
         if obj.type != "MESH":
             # Skip non-mesh objects
             continue
-        # duplicate obj
-        new_obj = obj.copy()
-        if obj.data:
+        mesh_data = mesh_helpers.new_mesh_from_evaluated_object(context, obj, depsgraph)
+        if mesh_data is None:
+            # Objects the depsgraph doesn't evaluate, such as ones hidden in the viewport, are copied as they are
+            # and processed below
+            new_obj = obj.copy()
             new_obj.data = obj.data.copy()
-        new_obj.animation_data_clear()
+            new_obj.animation_data_clear()
+        else:
+            # Copy the object so its vertex group names, custom properties and settings come along,
+            # then drop everything that is already baked into the new mesh
+            new_obj = obj.copy()
+            new_obj.data = mesh_data
+            new_obj.animation_data_clear()
+            new_obj.modifiers.clear()
+            new_obj.constraints.clear()
+            new_obj.parent = None
+            new_obj.matrix_basis = Matrix.Identity(4)
+            for slot in new_obj.material_slots:
+                slot.link = 'DATA'
+            ledger.mark_applied([new_obj], ledger.MODIFIERS)
+            ledger.mark_applied([new_obj], ledger.TRANSFORMS)
+        new_objs.append((obj.name, new_obj))
+
+    # Link the copies only once every object has been evaluated
+    for source_name, new_obj in new_objs:
         new_parent_collection.objects.link(new_obj)
-        new_objs.append(new_obj)
-        new_obj.name = new_name + "_" + obj.name
-
-    mesh_helpers.clear_parents_keep_transforms_on_meshes(new_objs)
+        new_obj.name = new_name + "_" + source_name
+    new_objs = [new_obj for _, new_obj in new_objs]
 
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
+    unbaked_objs = ledger.pending(new_objs, ledger.TRANSFORMS)
+    if len(unbaked_objs) > 0:
+        mesh_helpers.clear_parents_keep_transforms_on_meshes(unbaked_objs)
 
-    mesh_helpers.apply_all_modifiers(context, new_objs)
+        mesh_helpers.apply_all_modifiers(context, unbaked_objs)
+        ledger.mark_applied(unbaked_objs, ledger.MODIFIERS)
 
-    mesh_helpers.fix_negative_scales(new_objs)
+        mesh_helpers.fix_negative_scales(unbaked_objs)
 
     mesh_helpers.delete_vertices_with_no_faces_from_meshes(new_objs)
 
-    mesh_helpers.apply_all_transforms(context, new_objs)
+    mesh_helpers.apply_all_transforms(context, unbaked_objs)
+    ledger.mark_applied(unbaked_objs, ledger.TRANSFORMS)
 
     mesh_helpers.remove_blank_materials(new_objs)
 
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
-    # Selected each of the new objects
-    for obj in new_objs:
-        obj.select_set(True)
-        # set active object
-        context.view_layer.objects.active = obj
-
     # UV all the new objects
-    bpy.ops.rushhourvp.auto_uv_worldspace(selected_objects_only=True)
+    with timing_helpers.stage("apply_worldspace_uvs", new_objs):
+        operator_scale_UV_worldspace.apply_worldspace_uvs_to_meshes(context, new_objs, ledger=ledger)
 
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
+    return new_objs
 
-    new_objects = merge_objects(context, new_objs, new_name)
 
+def merge_processed_objects(context, objects, new_name, ledger=None):
+    with timing_helpers.stage("merge_objects", objects) as record:
+        new_objects = merge_objects(context, objects, new_name, ledger)
+        record.set_output(new_objects)
     return new_objects
 
 
-def prep_wheel(context, wheel_collection, new_parent_collection):
-    if wheel_collection.hide_render:
-        # Skip this collection as it's likely booleans and other stuff that we don't want
-        return
+def prep_objects(context, objects, new_name, new_parent_collection, ledger=None):
+    if ledger is None:
+        ledger = mesh_helpers.ProcessingLedger()
+    new_objs = process_objects(context, objects, new_name, new_parent_collection, ledger)
+    return merge_processed_objects(context, new_objs, new_name, ledger)
+
 
+def get_wheel_part_collections(wheel_collection):
     wheel_name_split = wheel_collection.name.split("_")
     axle = int(wheel_name_split[1])
     side = wheel_name_split[2]
     caliper_name = "brake_caliper_" + str(axle) + "_" + side
     rim_name = "rim_" + str(axle) + "_" + side
-    # Get the brake caliper collection from the wheel_collection
+    # Get the brake caliper and rim collections from the wheel_collection
     caliper_collection = wheel_collection.children[caliper_name]
     rim_collection = wheel_collection.children[rim_name]
+    return caliper_collection, rim_collection
 
-    rim_objects = []
-    for obj in rim_collection.all_objects:
-        if obj.hide_render:
-            # Don't operate on hidden objects
-            continue
-        rim_objects.append(obj)
-        # deselect all
-        bpy.ops.object.select_all(action='DESELECT')
-        obj.select_set(True)
-        mesh_helpers.apply_all_modifiers(context, [obj])
-        obj.select_set(False)
-        recenter_object_origin(obj)
-
-    rim_objects = prep_objects(context, rim_objects, rim_collection.name + "_rim", new_parent_collection)
-
-    caliper_objects = []
-    for obj in caliper_collection.all_objects:
-        if obj.hide_render:
-            # Don't operate on hidden objects
-            continue
-        caliper_objects.append(obj)
 
-    caliper_objects = prep_objects(context, caliper_objects, caliper_collection.name, new_parent_collection)
+def get_wheel_parts(wheel_collection):
+    """Returns a (role, object) pair for every visible mesh in the wheel collection.
+    The role is "caliper" or "rim" for objects in those sub collections, and "tyre" for everything else"""
+    caliper_collection, rim_collection = get_wheel_part_collections(wheel_collection)
+    caliper_objects = set(caliper_collection.all_objects)
+    rim_objects = set(rim_collection.all_objects)
 
-    tire_objects = []
+    parts = []
     for obj in wheel_collection.all_objects:
-        if obj.hide_render:
-            # Don't operate on hidden objects
+        if obj.hide_render or obj.type != "MESH":
             continue
-        # deselect all
-        bpy.ops.object.select_all(action='DESELECT')
-        obj.select_set(True)
-        mesh_helpers.apply_all_modifiers(context, [obj])
-        obj.select_set(False)
-        tire_objects.append(obj)
-        recenter_object_origin(obj)
-
-    # Remove the other bespoke objects from the wheel objects
-    for caliper_obj in caliper_collection.all_objects:
-        if caliper_obj in tire_objects:
-            tire_objects.remove(caliper_obj)
-    for rim_obj in rim_collection.all_objects:
-        if rim_obj in tire_objects:
-            tire_objects.remove(rim_obj)
-
-    tire_objects = prep_objects(context, tire_objects, wheel_collection.name + "_tyre", new_parent_collection)
-
-    wheel_size = mesh_helpers.get_bounds_of_meshes(tire_objects)
+        if obj in caliper_objects:
+            parts.append(("caliper", obj))
+        elif obj in rim_objects:
+            parts.append(("rim", obj))
+        else:
+            parts.append(("tyre", obj))
+    return parts
+
+
+def _wheel_parts_match(matrix, canonical_parts, instance_parts):
+    # Every canonical part moved by the matrix has to land exactly on an identical part of the instance
+    unmatched_parts = list(instance_parts)
+    for part_key, obj in canonical_parts:
+        expected_matrix = matrix @ np.array(obj.matrix_world, dtype=np.float64)
+        for part_idx, (instance_key, instance_obj) in enumerate(unmatched_parts):
+            if instance_key == part_key and np.allclose(np.array(instance_obj.matrix_world, dtype=np.float64),
+                                                        expected_matrix, atol=WHEEL_INSTANCE_TOLERANCE):
+                del unmatched_parts[part_idx]
+                break
+        else:
+            return False
+    return True
+
+
+def find_wheel_instance_matrix(canonical_parts, instance_parts):
+    """Returns the matrix that moves every part of the canonical wheel onto the identical part of the instance
+    wheel, or None if the wheels aren't identical. The matrix may only move, rotate and mirror the wheel, so
+    the world space size of everything stays the same.
+    The parts are ((role, geometry fingerprint), object) pairs"""
+    if not canonical_parts or sorted(key for key, _ in canonical_parts) != sorted(key for key, _ in instance_parts):
+        return None
+
+    first_key, first_obj = canonical_parts[0]
+    first_inverse = np.array(first_obj.matrix_world.inverted_safe(), dtype=np.float64)
+    for instance_key, instance_obj in instance_parts:
+        if instance_key != first_key:
+            continue
+        matrix = np.array(instance_obj.matrix_world, dtype=np.float64) @ first_inverse
+        rotation = matrix[:3, :3]
+        if not np.allclose(rotation.T @ rotation, np.identity(3), atol=WHEEL_INSTANCE_TOLERANCE):
+            # Scaled copies would need their UVs and measurements rebuilt
+            continue
+        if _wheel_parts_match(matrix, canonical_parts, instance_parts):
+            return Matrix(matrix.tolist())
+    return None
+
+
+def group_wheel_instances(wheel_collections):
+    """Groups geometrically identical wheel collections, including mirrored ones.
+    Returns a list of (canonical collection, [(instance collection, matrix), ...]) pairs"""
+    groups = []
+    for wheel_collection in wheel_collections:
+        parts = [((role, mesh_helpers.get_geometry_fingerprint(obj)), obj) for role, obj in get_wheel_parts(wheel_collection)]
+        for canonical_collection, canonical_parts, instances in groups:
+            matrix = find_wheel_instance_matrix(canonical_parts, parts)
+            if matrix is not None:
+                instances.append((wheel_collection, matrix))
+                break
+        else:
+            groups.append((wheel_collection, parts, []))
+
+    return [(canonical_collection, instances) for canonical_collection, _, instances in groups]
+
+
+def clone_prepped_object(context, source_object, matrix, new_name, new_parent_collection):
+    """Copies a prepped object, moving the copy by matrix and baking the rotation and mirroring into the mesh the
+    same way prep_objects does, so the copy is indistinguishable from one that was prepped from scratch"""
+    new_obj = source_object.copy()
+    new_obj.data = source_object.data.copy()
+    new_parent_collection.objects.link(new_obj)
+    new_obj.name = new_name
+    new_obj.matrix_world = matrix @ source_object.matrix_world
+    mesh_helpers.apply_all_transforms(context, [new_obj])
+    recenter_object_origin(new_obj)
+    return new_obj
+
+
+def set_wheel_measurements(wheel_objects, tire_coords, rim_coords, matrix=None):
+    # Measure the exact bounds of the tyre and rim vertices, moved by the matrix for cloned wheels
+    wheel_size = mesh_helpers.get_bounds_of_coordinates(tire_coords, matrix)
     wheel_radius = mesh_helpers.get_x_size_of_bounds(wheel_size) / 2
     wheel_width = mesh_helpers.get_y_size_of_bounds(wheel_size)
     rim_radius = wheel_radius
 
-    if len(rim_objects) > 0:
-        rim_size = mesh_helpers.get_bounds_of_meshes(rim_objects)
+    if len(rim_coords) > 0:
+        rim_size = mesh_helpers.get_bounds_of_coordinates(rim_coords, matrix)
         rim_radius = mesh_helpers.get_x_size_of_bounds(rim_size) / 2
 
-    wheel_objects = prep_objects(context, tire_objects + rim_objects, wheel_collection.name, new_parent_collection)
-
-    # Deselect all
-    bpy.ops.object.select_all(action='DESELECT')
-
-    # delete tire objects
-    for obj in tire_objects:
-        obj.select_set(True)
-    # delete rim objects
-    for obj in rim_objects:
-        obj.select_set(True)
-    bpy.ops.object.delete()
-
     # Add wheel radius as custom property to new merged wheel
     for obj in wheel_objects:
         obj["wheel_radius"] = wheel_radius
@@ -302,10 +308,79 @@ def prep_wheel(context, wheel_collection, new_parent_collection):
         obj["rim_radius"] = rim_radius
 
 
-def prep_vehicle_process(context):
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
+def prep_wheel(context, wheel_collection, new_parent_collection, instances=(), ledger=None):
+    """Preps a wheel collection into a merged wheel and a brake caliper.
+    instances are (wheel collection, matrix) pairs of identical wheels from group_wheel_instances. They are cloned
+    from the result of this wheel instead of being prepped again.
+    Returns a dict of collection name to (wheel objects, caliper objects), for this wheel and every instance"""
+    if wheel_collection.hide_render:
+        # Skip this collection as it's likely booleans and other stuff that we don't want
+        return {}
+
+    caliper_collection, _ = get_wheel_part_collections(wheel_collection)
+
+    wheel_parts = get_wheel_parts(wheel_collection)
+    tire_sources = [obj for role, obj in wheel_parts if role == "tyre"]
+    rim_sources = [obj for role, obj in wheel_parts if role == "rim"]
+    caliper_sources = [obj for role, obj in wheel_parts if role == "caliper"]
+
+    if ledger is None:
+        ledger = mesh_helpers.ProcessingLedger()
+
+    # Process every source object exactly once, in a single batch
+    processed_objects = process_objects(context, tire_sources + rim_sources + caliper_sources,
+                                        wheel_collection.name, new_parent_collection, ledger)
+    tire_objects = processed_objects[:len(tire_sources)]
+    rim_objects = processed_objects[len(tire_sources):len(tire_sources) + len(rim_sources)]
+    caliper_objects = processed_objects[len(tire_sources) + len(rim_sources):]
+
+    # Keep the processed tyre and rim vertices to measure this wheel and every cloned wheel
+    tire_coords = mesh_helpers.get_world_vertex_coordinates(tire_objects)
+    rim_coords = mesh_helpers.get_world_vertex_coordinates(rim_objects)
+
+    wheel_objects = merge_processed_objects(context, tire_objects + rim_objects, wheel_collection.name, ledger)
+    caliper_objects = merge_processed_objects(context, caliper_objects, caliper_collection.name, ledger)
+
+    set_wheel_measurements(wheel_objects, tire_coords, rim_coords)
+    prepped_wheels = {wheel_collection.name: (wheel_objects, caliper_objects)}
+
+    for instance_collection, matrix in instances:
+        # Each clone is recorded as its own stage in the ledger
+        with timing_helpers.stage("clone_wheel:" + instance_collection.name, wheel_objects + caliper_objects) as record:
+            instance_caliper_collection, _ = get_wheel_part_collections(instance_collection)
+            instance_wheel_objects = [clone_prepped_object(context, obj, matrix, instance_collection.name, new_parent_collection)
+                                      for obj in wheel_objects]
+            instance_caliper_objects = [clone_prepped_object(context, obj, matrix, instance_caliper_collection.name, new_parent_collection)
+                                        for obj in caliper_objects]
+            record.set_output(instance_wheel_objects + instance_caliper_objects)
+        set_wheel_measurements(instance_wheel_objects, tire_coords, rim_coords, matrix)
+        prepped_wheels[instance_collection.name] = (instance_wheel_objects, instance_caliper_objects)
+
+    return prepped_wheels
+
+
+def tag_prepped_objects(objects, source_collection, fingerprint):
+    # Remember which source collection the prepped objects were built from, so an incremental prep can tell
+    # whether they're still up to date
+    for obj in objects:
+        obj["rh_source_collection"] = source_collection.name
+        if fingerprint is None:
+            obj.pop("rh_source_fingerprint", None)
+        else:
+            obj["rh_source_fingerprint"] = fingerprint
+
+
+def is_prepped_up_to_date(prepped_objects, fingerprint):
+    if not prepped_objects or fingerprint is None:
+        return False
+    return all(obj.get("rh_source_fingerprint") == fingerprint for obj in prepped_objects)
+
 
+def prep_vehicle_process(context, incremental=False):
+    """Preps every collection in the vehicle collection into the prepped collection.
+    When incremental is set, the prepped objects of source collections that haven't changed since the
+    last prep are kept, and only the changed collections are rebuilt. Fingerprints are only worked out for an
+    incremental prep, so the first incremental prep after a full one rebuilds everything."""
     # Create collection "prepped"
     prepped_collection = collection_helpers.create_top_level_collection('prepped')
 
@@ -316,39 +391,116 @@ def prep_vehicle_process(context):
     original_layer_visibility = layer_collection.hide_viewport
     layer_collection.hide_viewport = False
 
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
-
-    # Delete everything in the prepped collection
+    # Group the existing prepped objects by the collection they were built from
+    prepped_by_source = {}
+    proxy_mesh_obj = None
     for obj in prepped_collection.all_objects:
-        obj.select_set(True)
-    bpy.ops.object.delete()
+        if incremental and obj.name == "proxy":
+            proxy_mesh_obj = obj
+            continue
+        prepped_by_source.setdefault(obj.get("rh_source_collection") if incremental else None, []).append(obj)
+
+    # Everything that gets replaced is freed in bulk, along with the meshes it leaves behind
+    orphan_collector = datablock_helpers.OrphanCollector()
 
-    # Create proxy mesh for the empty skeleton rig
-    proxy_mesh_obj = create_proxy_mesh()
-    proxy_mesh_obj.select_set(True)
-    context.view_layer.objects.active = proxy_mesh_obj
+    # Delete everything that can't be matched to a source collection. For a full prep that's everything
+    orphan_collector.add_objects(prepped_by_source.pop(None, []))
 
-    # UV the proxy mesh
-    bpy.ops.rushhourvp.auto_uv_worldspace(selected_objects_only=True)
-    proxy_mesh_obj.select_set(False)
+    if incremental:
+        # Undo the floor centering of the last prep, so kept and rebuilt objects line up again
+        floor_offset = Vector(prepped_collection.get("rh_floor_offset", (0.0, 0.0, 0.0)))
+        for objects in prepped_by_source.values():
+            for obj in objects:
+                obj.location -= floor_offset
 
     # Get collection "vehicle"
     vehicle_collection = bpy.data.collections["vehicle"]
 
+    rebuilt_count = 0
+    kept_count = 0
+
+    # Work out which collections need to be rebuilt, and free their old prepped objects first so the new
+    # objects get their names back
+    collections_to_prep = []
+    collection_fingerprints = {}
     # for each collection in the parent "vehicle" collection
     for collection in vehicle_collection.children:
         if collection.name == "wheels":
             # Skip wheels for now, they are processed separately
             continue
-        prep_collection(context, collection, prepped_collection)
+        previous_objects = prepped_by_source.pop(collection.name, [])
+        fingerprint = None
+        if incremental:
+            fingerprint = mesh_helpers.get_objects_fingerprint(get_collection_objects_to_process(collection))
+        if not collection.hide_render and is_prepped_up_to_date(previous_objects, fingerprint):
+            kept_count += 1
+            continue
+        orphan_collector.add_objects(previous_objects)
+        collections_to_prep.append(collection)
+        collection_fingerprints[collection.name] = fingerprint
 
     # Get the wheel collection from vehicle_collection
     wheel_collection = vehicle_collection.children["wheels"]
+    wheel_collections_to_prep = []
+    for collection in wheel_collection.children:
+        previous_objects = prepped_by_source.pop(collection.name, [])
+        fingerprint = None
+        if incremental:
+            fingerprint = mesh_helpers.get_objects_fingerprint(collection.all_objects)
+        if not collection.hide_render and is_prepped_up_to_date(previous_objects, fingerprint):
+            kept_count += 1
+            continue
+        orphan_collector.add_objects(previous_objects)
+        if not collection.hide_render:
+            wheel_collections_to_prep.append(collection)
+            collection_fingerprints[collection.name] = fingerprint
+
+    # Delete prepped objects whose source collection no longer exists
+    for objects in prepped_by_source.values():
+        orphan_collector.add_objects(objects)
+
+    orphan_collector.collect()
+
+    if proxy_mesh_obj is None:
+        # Create proxy mesh for the empty skeleton rig
+        proxy_mesh_obj = create_proxy_mesh()
+
+        # UV the proxy mesh
+        operator_scale_UV_worldspace.apply_worldspace_uvs_to_meshes(context, [proxy_mesh_obj])
+
+    # Tracks the processing applied to every object, so no stage repeats the work of an earlier one
+    ledger = mesh_helpers.ProcessingLedger()
+
+    for collection in collections_to_prep:
+        # Free the intermediate meshes of each stage as soon as it's done, rather than at the end of the next run
+        with orphan_collector.collecting(), \
+                timing_helpers.stage("prep_collection:" + collection.name, collection.all_objects) as record:
+            new_objects = prep_collection(context, collection, prepped_collection, ledger)
+            record.set_output(new_objects)
+        if new_objects:
+            tag_prepped_objects(new_objects, collection, collection_fingerprints[collection.name])
+            rebuilt_count += 1
+
     # Create a new parent collection for the wheels
     prepped_wheel_parent_collection = collection_helpers.create_collection("prepped_wheels", prepped_collection)
-    for collection in wheel_collection.children:
-        prep_wheel(context, collection, prepped_wheel_parent_collection)
+
+    # Identical wheels are only prepped once, the others are cloned from the prepped result
+    for canonical_collection, instances in group_wheel_instances(wheel_collections_to_prep):
+        source_objects = list(canonical_collection.all_objects)
+        for instance_collection, _ in instances:
+            source_objects.extend(instance_collection.all_objects)
+        with orphan_collector.collecting(), \
+                timing_helpers.stage("prep_wheel:" + canonical_collection.name, source_objects) as record:
+            prepped_wheels = prep_wheel(context, canonical_collection, prepped_wheel_parent_collection, instances, ledger)
+            record.set_output([obj for wheel_objects, caliper_objects in prepped_wheels.values()
+                               for obj in wheel_objects + caliper_objects])
+
+        for collection in [canonical_collection] + [instance_collection for instance_collection, _ in instances]:
+            wheel_objects, caliper_objects = prepped_wheels.get(collection.name, ([], []))
+            new_objects = wheel_objects + caliper_objects
+            if new_objects:
+                tag_prepped_objects(new_objects, collection, collection_fingerprints[collection.name])
+                rebuilt_count += 1
 
     # Gather meshes to center
     prepped_meshes = []
@@ -357,13 +509,15 @@ def prep_vehicle_process(context):
             # Skip the proxy mesh for centering
             continue
         if obj.type == 'MESH':
-            obj.select_set(True)
             prepped_meshes.append(obj)
-    mesh_helpers.center_meshes_on_floor(context, prepped_meshes)
+    floor_offset = mesh_helpers.center_meshes_on_floor(context, prepped_meshes)
+    prepped_collection["rh_floor_offset"] = tuple(floor_offset)
 
     # re-hide the prepped collection from the viewport if necessary
     layer_collection.hide_viewport = original_layer_visibility
 
+    return rebuilt_count, kept_count, orphan_collector.reclaimed_bytes
+
 
 class RUSHHOURVP_OT_prepare_vehicle_for_unreal(bpy.types.Operator):
     """Prepares the vehicle for unreal.
@@ -372,9 +526,21 @@ class RUSHHOURVP_OT_prepare_vehicle_for_unreal(bpy.types.Operator):
     bl_idname = "rushhourvp.prep_vehicle_for_unreal"
     bl_label = "Prepare Vehicle For Unreal"
 
+    incremental: bpy.props.BoolProperty(
+        name='incremental',
+        default=False,
+        description="Only rebuild the prepped objects whose source collection changed since the last prep"
+    )
+
     def execute(self, context):
-        prep_vehicle_process(context)
+        uv_helpers.uv_result_cache.reset_stats()
+        # The selection is restored once the whole prep has run
+        with context_helpers.selection_snapshot(context):
+            rebuilt_count, kept_count, reclaimed_bytes = prep_vehicle_process(context, incremental=self.incremental)
         bpy.ops.rushhourvp.check_vehicle()
+        self.report({'INFO'}, f"Rebuilt {rebuilt_count} collections, kept {kept_count}. "
+                              f"Reclaimed about {datablock_helpers.format_bytes(reclaimed_bytes)}. "
+                              f"UV cache: {uv_helpers.uv_result_cache.hits} hits, {uv_helpers.uv_result_cache.misses} misses")
         return {'FINISHED'}
 
 
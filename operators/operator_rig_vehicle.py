@@ -5,6 +5,10 @@
 import bpy
 from mathutils import Vector
 from ..utils import collection_helpers
+from ..utils import context_helpers
+from ..utils import datablock_helpers
+from ..utils import mesh_helpers
+from ..utils import timing_helpers
 
 
 def add_child_bone(context, name, armature, location, parent, bone_length=1):
@@ -17,9 +21,6 @@ def add_child_bone(context, name, armature, location, parent, bone_length=1):
 
 
 def assign_mesh_to_vertex_group(context, mesh, vertex_group_name):
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
-
     unused_vertex_group_names = mesh.vertex_groups.keys()
     unused_vertex_group_names.remove(vertex_group_name)
 
@@ -38,24 +39,21 @@ def assign_mesh_to_vertex_group(context, mesh, vertex_group_name):
 
 
 def decimate_mesh(context, mesh, decimate_amount=0.1):
-    # Add decimate modifier to wheel mesh
-    decimate_mod = mesh.modifiers.new("Decimate", 'DECIMATE')
-    decimate_mod.decimate_type = 'COLLAPSE'
-    decimate_mod.ratio = decimate_amount
-    mesh.select_set(True)
+    with timing_helpers.stage("decimate_mesh:" + mesh.name, [mesh]):
+        # Add decimate modifier to wheel mesh
+        decimate_mod = mesh.modifiers.new("Decimate", 'DECIMATE')
+        decimate_mod.decimate_type = 'COLLAPSE'
+        decimate_mod.ratio = decimate_amount
 
-    bpy.context.view_layer.objects.active = mesh
-    # Clear custom normals
-    bpy.ops.mesh.customdata_custom_splitnormals_clear()
-    # Apply decimate modifier to skeleton wheel mesh
-    bpy.ops.object.modifier_apply(modifier="Decimate")
-    mesh.select_set(False)
+        with context_helpers.object_override(context, [mesh], mesh):
+            # Clear custom normals
+            bpy.ops.mesh.customdata_custom_splitnormals_clear()
+            # Apply decimate modifier to skeleton wheel mesh
+            bpy.ops.object.modifier_apply(modifier="Decimate")
+        timing_helpers.count_ops_calls(2)
 
 
 def duplicate_meshes_for_skeletal_mesh(context, skel_collection, decimate_proxy_mesh: bool = True, decimate_amount: float = 0.1):
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
-
     # Get the "prepped" collection
     prepped_collection = bpy.data.collections["prepped"]
 
@@ -96,8 +94,13 @@ def rename_object_and_data(obj, new_name):
     # get existing data block with name "new_name"
     if new_name in bpy.data.meshes:
         existing_data = bpy.data.meshes[new_name]
-        print("Found existing data block with name " + new_name + ", renaming to " + new_name + "_temp_rename_12345")
-        existing_data.name = new_name + "_copy"
+        if existing_data.users == 0:
+            # Nothing uses the old data any more, so free it rather than keeping an orphan around
+            print("Removing orphaned data block with name " + new_name)
+            bpy.data.meshes.remove(existing_data)
+        else:
+            print("Found existing data block with name " + new_name + ", renaming to " + new_name + "_copy")
+            existing_data.name = new_name + "_copy"
 
     obj.data.name = new_name
 
@@ -165,25 +168,18 @@ def duplicate_for_static_mesh_collection(context, parent_collection):
         new_obj.location -= wheel_location
 
 def join_skeletal_mesh(context, meshes):
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
-
-    # Join wheels and body
-    for mesh in meshes:
-        mesh.select_set(True)
-    # set active object
-    context.view_layer.objects.active = meshes[0]
-
-    # Join meshes in collection
-    bpy.ops.object.join()
+    with timing_helpers.stage("join_skeletal_mesh", meshes) as record:
+        # Join wheels and body into the first mesh. This is a plain join, so the normals and material slots of
+        # the physics parts are exported exactly as they are
+        with context_helpers.object_override(context, meshes, meshes[0]):
+            bpy.ops.object.join()
+        timing_helpers.count_ops_calls()
+        record.set_output([meshes[0]])
 
 
 def rig_vehicle(context, decimate_proxy_mesh: bool = True, decimate_amount: float = 0.1):
     default_bone_length = 100
 
-    # deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
-
     # Create an "Export" collection at the top level
     export_collection = collection_helpers.create_top_level_collection("export")
 
@@ -194,19 +190,22 @@ def rig_vehicle(context, decimate_proxy_mesh: bool = True, decimate_amount: floa
     original_layer_visibility = layer_collection.hide_viewport
     layer_collection.hide_viewport = False
 
-    # Delete everything in the export collection
-    for obj in export_collection.all_objects:
-        obj.select_set(True)
-    bpy.ops.object.delete()
+    # Delete everything in the export collection, and the meshes and armatures it leaves behind
+    orphan_collector = datablock_helpers.OrphanCollector()
+    orphan_collector.add_objects(export_collection.all_objects)
+    orphan_collector.collect()
 
     # Create a skeleton collection within export
     skeleton_collection = collection_helpers.create_collection("skeleton", export_collection)
 
-    # Duplicate and move static meshes to origin for export and attaching to skeleton
-    duplicate_for_static_mesh_collection(context, export_collection)
+    # Duplicate and move static meshes to origin for export and attaching to skeleton.
+    # Each stage frees any meshes it leaves without users as soon as it's done
+    with orphan_collector.collecting():
+        duplicate_for_static_mesh_collection(context, export_collection)
 
     # Duplicate meshes for skeletal mesh "physics" mesh
-    duplicate_meshes_for_skeletal_mesh(context, skeleton_collection, decimate_proxy_mesh=decimate_proxy_mesh, decimate_amount=decimate_amount)
+    with orphan_collector.collecting():
+        duplicate_meshes_for_skeletal_mesh(context, skeleton_collection, decimate_proxy_mesh=decimate_proxy_mesh, decimate_amount=decimate_amount)
 
     # Create an armature object
     # For unreal not to create a new bone at the root, the armature must be named "Armature"
@@ -221,15 +220,12 @@ def rig_vehicle(context, decimate_proxy_mesh: bool = True, decimate_amount: floa
     armature_obj.show_axis = True
     armature_obj.data.show_axes = True
 
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
-
-    # Select the armature object
-    armature_obj.select_set(True)
-    context.view_layer.objects.active = armature_obj
+    # Select only the armature object, edit mode works on the view layer selection
+    context_helpers.select_only(context, [armature_obj], armature_obj)
 
     # Enter edit mode
     bpy.ops.object.mode_set(mode='EDIT')
+    timing_helpers.count_ops_calls()
 
     body_obj = skeleton_collection.objects["SK_phys_mesh"]
 
@@ -258,27 +254,17 @@ def rig_vehicle(context, decimate_proxy_mesh: bool = True, decimate_amount: floa
 
     # Exit edit mode
     bpy.ops.object.mode_set(mode='OBJECT')
+    timing_helpers.count_ops_calls()
 
     # Now parent to objects to the armature
 
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
+    armature_obj.select_set(False)
 
-    # Select all the wheels and the body
-    for wheel_obj in wheel_objs:
-        wheel_obj.select_set(True)
-    for caliper_obj in caliper_objs:
-        caliper_obj.select_set(True)
-    proxy_mesh_obj.select_set(True)
-    body_obj.select_set(True)
-
-    # Set the armature to the active object
-    context.view_layer.objects.active = armature_obj
-    # Parent the meshes to the armature
-    bpy.ops.object.parent_set(type='ARMATURE_NAME')
-
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
+    # Parent the wheels, calipers, proxy and body to the armature, with the armature as the active object
+    meshes_to_parent = wheel_objs + caliper_objs + [proxy_mesh_obj, body_obj]
+    with context_helpers.object_override(context, meshes_to_parent + [armature_obj], armature_obj):
+        bpy.ops.object.parent_set(type='ARMATURE_NAME')
+    timing_helpers.count_ops_calls()
 
     # Assign vertex groups to the meshes
     assign_mesh_to_vertex_group(context, body_obj, "body")
@@ -291,12 +277,15 @@ def rig_vehicle(context, decimate_proxy_mesh: bool = True, decimate_amount: floa
     # DO NOT ADD PROXY OBJECT TO THIS LIST
     # the proxy object should not be merged
     meshes_to_join = [body_obj] + wheel_objs + caliper_objs
-    # Join the skeletal mesh for the physics object
-    join_skeletal_mesh(context, meshes_to_join)
+    # Join the skeletal mesh for the physics object. The join operator leaves the meshes of the joined objects behind
+    with orphan_collector.collecting([mesh.data for mesh in meshes_to_join]):
+        join_skeletal_mesh(context, meshes_to_join)
 
     # Change the layer collection visibility back to the original state
     layer_collection.hide_viewport = original_layer_visibility
 
+    return orphan_collector.reclaimed_bytes
+
 
 class RUSHHOURVP_OT_rig_vehicle(bpy.types.Operator):
     """Rigs prepped vehicle for export to Unreal"""
@@ -322,7 +311,10 @@ class RUSHHOURVP_OT_rig_vehicle(bpy.types.Operator):
         return True
 
     def execute(self, context):
-        rig_vehicle(context, self.decimate_proxy_mesh, self.decimate_amount)
+        # The selection is restored once the whole rig has run
+        with context_helpers.selection_snapshot(context):
+            reclaimed_bytes = rig_vehicle(context, self.decimate_proxy_mesh, self.decimate_amount)
+        self.report({'INFO'}, f"Reclaimed about {datablock_helpers.format_bytes(reclaimed_bytes)} from the previous rig and intermediate meshes")
         return {'FINISHED'}
 
 
@@ -5,33 +5,24 @@
 import math
 
 import bpy
-from ..utils import mesh_helpers, uv_helpers
+import numpy as np
+from mathutils import Matrix
+from ..utils import context_helpers, mesh_helpers, timing_helpers, uv_helpers
 
+# UV units per world unit. With the scene in centimetres this maps 1 metre to 1 UV unit
+WORLDSPACE_UV_SCALE = 0.01
 
-def apply_worldspace_uvs(context, curr_object: bpy.types.Object, apply_modifiers=True, apply_scale=True):
-    if curr_object.enable_auto_uv is False:
-        print("Skipping object marked for disabled auto UV " + curr_object.name)
-        return
-    bpy.context.view_layer.objects.active = curr_object
-    curr_object.select_set(True)
+# Default texel density, matching WORLDSPACE_UV_SCALE on a 1024 texture
+DEFAULT_TEXTURE_SIZE = 1024
+DEFAULT_TEXELS_PER_CM = WORLDSPACE_UV_SCALE * DEFAULT_TEXTURE_SIZE
 
-    if apply_modifiers:
-        # apply all modifiers to selected object
-        mesh_helpers.apply_all_modifiers(context, [curr_object])
-    if apply_scale:
-        bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
+SMART_PROJECT_ISLAND_MARGIN = 0.01
 
-    # Smart project a set of UVs
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.select_all(action='DESELECT')
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.uv.smart_project(island_margin=0.01)
 
-    bpy.ops.object.mode_set(mode='OBJECT')
-
-    num_faces = len(curr_object.data.polygons)
+def scale_uvs_to_worldspace(curr_object: bpy.types.Object, uv_scale=WORLDSPACE_UV_SCALE):
+    """Rescales the existing UVs of an object so the UV area matches its world size"""
     total_surface_area = mesh_helpers.get_surface_area_of_mesh(curr_object)
-    total_surface_area *= 0.0001
+    total_surface_area *= uv_scale ** 2
     total_uv_area = uv_helpers.get_uv_area(curr_object)
     # print("Face Area: " + str(total_surface_area))
     # print("UV Area: " + str(total_uv_area))
@@ -46,36 +37,150 @@ def apply_worldspace_uvs(context, curr_object: bpy.types.Object, apply_modifiers
 
     uv_helpers.scale_uvs_object(curr_object, scaling_factor)
 
-    total_uv_area_after_scaling = uv_helpers.get_uv_area(curr_object)
-    # print("UV Area after scaling: " + str(total_uv_area_after_scaling))
-    # Recenter UV islands
 
-    curr_object.select_set(False)
+def scale_uv_islands_to_worldspace(curr_object: bpy.types.Object, uv_scale=WORLDSPACE_UV_SCALE):
+    """Rescales each UV island of an object separately, so every island has the same texel density"""
+    island_labels, num_islands = uv_helpers.get_uv_island_labels(curr_object)
+    if num_islands == 0:
+        return
+
+    _, uv_poly_areas = uv_helpers.get_uv_areas_for_polys(curr_object)
+    face_areas = mesh_helpers.get_face_areas(curr_object)
+
+    island_surface_areas = np.bincount(island_labels, weights=face_areas, minlength=num_islands)
+    island_surface_areas *= uv_scale ** 2
+    island_uv_areas = np.bincount(island_labels, weights=uv_poly_areas, minlength=num_islands)
+
+    # Leave islands without a valid area untouched
+    island_scaling_factors = np.ones(num_islands)
+    valid_islands = (island_surface_areas > 0) & (island_uv_areas > 0)
+    island_scaling_factors[valid_islands] = np.sqrt(island_surface_areas[valid_islands] / island_uv_areas[valid_islands])
+
+    uv_helpers.scale_uvs_islands(curr_object, island_labels, island_scaling_factors)
+
+
+def get_uv_cache_key(curr_object: bpy.types.Object, projection_mode, scaling_mode, uv_scale):
+    unwrap_settings = (projection_mode, scaling_mode, uv_scale, SMART_PROJECT_ISLAND_MARGIN)
+    if projection_mode == 'BOX':
+        # Box projection depends on where the object is in the world
+        unwrap_settings += tuple(tuple(row) for row in curr_object.matrix_world)
+    return mesh_helpers.get_mesh_fingerprint(curr_object, unwrap_settings)
+
+
+def apply_worldspace_uvs(context, curr_object: bpy.types.Object, apply_modifiers=True, apply_scale=True, projection_mode='SMART_PROJECT',
+                         scaling_mode='OBJECT', uv_scale=WORLDSPACE_UV_SCALE, use_cache=True):
+    apply_worldspace_uvs_to_meshes(context, [curr_object], apply_modifiers, apply_scale, projection_mode, scaling_mode, uv_scale, use_cache)
+
+
+def apply_worldspace_uvs_to_meshes(context, objects, apply_modifiers=True, apply_scale=True, projection_mode='SMART_PROJECT',
+                                   scaling_mode='OBJECT', uv_scale=WORLDSPACE_UV_SCALE, use_cache=True, ledger=None):
+    """Unwraps all the given meshes at once. Smart project runs a single time with every mesh in multi-object
+    edit mode, then each mesh is rescaled to world size afterwards.
+    When use_cache is set, meshes that were unwrapped before with the same geometry and settings get their
+    UVs restored from uv_helpers.uv_result_cache instead.
+    With a mesh_helpers.ProcessingLedger, meshes that already had their modifiers, scale or UVs applied skip
+    those steps, and the steps done here are recorded in it."""
+    meshes = []
+    for curr_object in objects:
+        if curr_object.enable_auto_uv is False:
+            print("Skipping object marked for disabled auto UV " + curr_object.name)
+            continue
+        if ledger is not None and ledger.is_applied(curr_object, ledger.UVS):
+            continue
+        meshes.append(curr_object)
+
+    if len(meshes) == 0:
+        return
+
+    if apply_modifiers:
+        # apply all modifiers to the meshes
+        if ledger is None:
+            mesh_helpers.apply_all_modifiers(context, meshes)
+        else:
+            mesh_helpers.apply_all_modifiers(context, ledger.pending(meshes, ledger.MODIFIERS))
+            ledger.mark_applied(meshes, ledger.MODIFIERS)
+
+    if apply_scale:
+        meshes_to_scale = meshes if ledger is None else ledger.pending(meshes, ledger.TRANSFORMS)
+        if len(meshes_to_scale) == len(meshes):
+            with context_helpers.object_override(context, meshes):
+                bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
+            timing_helpers.count_ops_calls()
+        elif len(meshes_to_scale) > 0:
+            # Only some of the meshes still have a scale to apply, bake it directly into their data
+            mesh_helpers.transform_mesh_data(meshes_to_scale,
+                                             [Matrix.Diagonal(obj.scale).to_4x4() for obj in meshes_to_scale])
+            for curr_object in meshes_to_scale:
+                curr_object.scale = (1.0, 1.0, 1.0)
+
+    # Restore any meshes that have been unwrapped before, and only unwrap the rest
+    cache_keys = {}
+    if use_cache:
+        meshes_to_unwrap = []
+        for curr_object in meshes:
+            cache_key = get_uv_cache_key(curr_object, projection_mode, scaling_mode, uv_scale)
+            if uv_helpers.uv_result_cache.restore(curr_object, cache_key):
+                continue
+            cache_keys[curr_object.name_full] = cache_key
+            meshes_to_unwrap.append(curr_object)
+    else:
+        meshes_to_unwrap = meshes
+
+    if len(meshes_to_unwrap) > 0:
+        if projection_mode == 'BOX':
+            # Box projection is already in world units, so there is no need to measure and rescale
+            for curr_object in meshes_to_unwrap:
+                uv_helpers.box_project_uvs(curr_object, uv_scale)
+        else:
+            # Smart project a set of UVs for every mesh in one go. Multi-object edit mode works on the view layer
+            # selection, so the meshes have to really be selected here
+            context_helpers.select_only(context, meshes_to_unwrap, meshes_to_unwrap[0])
+            bpy.ops.object.mode_set(mode='EDIT')
+            bpy.ops.mesh.select_all(action='DESELECT')
+            bpy.ops.mesh.select_all(action='SELECT')
+            bpy.ops.uv.smart_project(island_margin=SMART_PROJECT_ISLAND_MARGIN)
+
+            bpy.ops.object.mode_set(mode='OBJECT')
+            timing_helpers.count_ops_calls(5)
+
+            for curr_object in meshes_to_unwrap:
+                curr_object.select_set(False)
+
+            for curr_object in meshes_to_unwrap:
+                if scaling_mode == 'ISLAND':
+                    scale_uv_islands_to_worldspace(curr_object, uv_scale)
+                else:
+                    scale_uvs_to_worldspace(curr_object, uv_scale)
+
+        for curr_object in meshes_to_unwrap:
+            if curr_object.name_full in cache_keys:
+                uv_helpers.uv_result_cache.store(cache_keys[curr_object.name_full],
+                                                 uv_helpers.get_uv_coords(curr_object.data))
+
+    if ledger is not None:
+        ledger.mark_applied(meshes, ledger.UVS)
 
     return
 
 
-def apply_worldspace_uv_to_objects(context, apply_modifiers=True, apply_scale=True, selected_objects_only=True):
+def apply_worldspace_uv_to_objects(context, apply_modifiers=True, apply_scale=True, selected_objects_only=True, projection_mode='SMART_PROJECT',
+                                   scaling_mode='OBJECT', uv_scale=WORLDSPACE_UV_SCALE, use_cache=True):
     selected_objects = bpy.context.selected_objects
     objects_to_process = selected_objects
     if selected_objects_only is False:
         objects_to_process = bpy.data.objects
 
-    # Deselect everything
-    bpy.ops.object.select_all(action='DESELECT')
-    for obj in selected_objects:
-        obj.select_set(False)
-
     # Process desired objects
+    meshes = []
     for sel_object in objects_to_process:
         if sel_object.type == 'MESH':
-            apply_worldspace_uvs(context, sel_object, apply_modifiers, apply_scale)
+            meshes.append(sel_object)
         else:
             print("Skipping non-mesh object: " + sel_object.name)
 
-    # Reselect the originally selected items
-    for obj in selected_objects:
-        obj.select_set(True)
+    # The originally selected items are reselected afterwards
+    with context_helpers.selection_snapshot(context):
+        apply_worldspace_uvs_to_meshes(context, meshes, apply_modifiers, apply_scale, projection_mode, scaling_mode, uv_scale, use_cache)
 
     print("=============================")
     print("WorldSpace UV Complete")
@@ -103,13 +208,57 @@ class RUSHHOURVP_OT_automatic_uv_unwrap_worldspace(bpy.types.Operator):
         default=True
     )
 
+    projection_mode: bpy.props.EnumProperty(
+        name='projection_mode',
+        items=[
+            ('SMART_PROJECT', "Smart Project", "Smart UV project, then rescale the UVs to world size"),
+            ('BOX', "Box Projection", "Project each face along its dominant world axis at world size. Much faster on large meshes"),
+        ],
+        default='SMART_PROJECT'
+    )
+
+    scaling_mode: bpy.props.EnumProperty(
+        name='scaling_mode',
+        items=[
+            ('OBJECT', "Per Object", "Scale all the UVs of an object by a single factor"),
+            ('ISLAND', "Per Island", "Scale each UV island separately so all islands have the same texel density"),
+        ],
+        default='OBJECT'
+    )
+
+    texels_per_cm: bpy.props.FloatProperty(
+        name='texels_per_cm',
+        default=DEFAULT_TEXELS_PER_CM,
+        min=0.001,
+        description="Target texel density in texels per centimetre"
+    )
+
+    texture_size: bpy.props.IntProperty(
+        name='texture_size',
+        default=DEFAULT_TEXTURE_SIZE,
+        min=1,
+        description="Texture resolution the texel density is measured against"
+    )
+
+    use_cache: bpy.props.BoolProperty(
+        name='use_cache',
+        default=True,
+        description="Reuse the UVs of meshes that have already been unwrapped with the same geometry and settings"
+    )
+
     @classmethod
     def poll(cls, context):
         obj = context.active_object
         return obj and obj.mode == 'OBJECT'
 
     def execute(self, context):
-        apply_worldspace_uv_to_objects(context, self.apply_modifiers, self.apply_scale, self.selected_objects_only)
+        uv_scale = self.texels_per_cm / self.texture_size
+        cache = uv_helpers.uv_result_cache
+        hits_before, misses_before = cache.hits, cache.misses
+        apply_worldspace_uv_to_objects(context, self.apply_modifiers, self.apply_scale, self.selected_objects_only, self.projection_mode,
+                                       self.scaling_mode, uv_scale, self.use_cache)
+        if self.use_cache:
+            self.report({'INFO'}, f"Worldspace UVs: {cache.hits - hits_before} cache hits, {cache.misses - misses_before} cache misses")
         return {'FINISHED'}
 
 
@@ -124,11 +273,19 @@ def menu_apply_worldspace_scale(self, context):
     menu_item.apply_modifiers = False
 
 
+def menu_apply_worldspace_box_projection(self, context):
+    menu_item = self.layout.operator(RUSHHOURVP_OT_automatic_uv_unwrap_worldspace.bl_idname,
+                                     text="Apply Worldspace UVs (Box Projection)")
+    menu_item.apply_modifiers = True
+    menu_item.projection_mode = 'BOX'
+
+
 def register():
     print("Registering Worldspace UV")
     bpy.utils.register_class(RUSHHOURVP_OT_automatic_uv_unwrap_worldspace)
     bpy.types.VIEW3D_MT_object.append(menu_apply_worldspace_uv_modifiers_and_scale)
     bpy.types.VIEW3D_MT_object.append(menu_apply_worldspace_scale)
+    bpy.types.VIEW3D_MT_object.append(menu_apply_worldspace_box_projection)
 
 
 def unregister():
@@ -136,3 +293,4 @@ def unregister():
     bpy.utils.unregister_class(RUSHHOURVP_OT_automatic_uv_unwrap_worldspace)
     bpy.types.VIEW3D_MT_object.remove(menu_apply_worldspace_uv_modifiers_and_scale)
     bpy.types.VIEW3D_MT_object.remove(menu_apply_worldspace_scale)
+    bpy.types.VIEW3D_MT_object.remove(menu_apply_worldspace_box_projection)
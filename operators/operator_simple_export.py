@@ -4,6 +4,8 @@
 
 import bpy
 
+from ..utils import timing_helpers
+
 import logging
 
 log = logging.getLogger(__name__)
@@ -19,6 +21,14 @@ This operator automatically runs the Prep, Rig and Export operators from the Rus
         return True
 
     def execute(self, context):
+        # Record the cost of every pipeline stage, the ledger is written next to the export manifest
+        timing_helpers.start_ledger(bpy.path.basename(context.blend_data.filepath))
+        try:
+            return self.run_pipeline(context)
+        finally:
+            timing_helpers.stop_ledger()
+
+    def run_pipeline(self, context):
         #prep
         try:
             bpy.ops.rushhourvp.prep_vehicle_for_unreal()
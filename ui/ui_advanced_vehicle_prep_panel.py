@@ -47,6 +47,8 @@ class RUSHHOURVP_PT_advanced_vehicle_panel(bpy.types.Panel):
         row.label(text="Prep Vehicle", icon='WORLD_DATA')
         row = layout.row()
         row.operator("rushhourvp.prep_vehicle_for_unreal", text="Prepare Vehicle for Unreal")
+        row = layout.row()
+        row.operator("rushhourvp.prep_vehicle_for_unreal", text="Re-Prep Changed Collections").incremental = True
 
         layout.separator(factor=2)
         row = layout.row()
@@ -0,0 +1,54 @@
+# Copyright © 2024 GDCorner
+# This is licensed under the MIT license. See the LICENSE file for full details
+# https://choosealicense.com/licenses/mit/
+
+from contextlib import contextmanager
+
+from .datablock_helpers import is_valid
+
+
+def select_only(context, objects, active=None):
+    """Makes the objects the only selected objects, and active the active object if given.
+    Only the currently selected objects are deselected, so this doesn't touch every object in the view layer
+    like bpy.ops.object.select_all does"""
+    objects = [obj for obj in objects if is_valid(obj)]
+    keep_selected = {obj.as_pointer() for obj in objects}
+    for obj in context.selected_objects:
+        if obj.as_pointer() not in keep_selected:
+            obj.select_set(False)
+    for obj in objects:
+        obj.select_set(True)
+    if active is not None:
+        context.view_layer.objects.active = active
+
+
+@contextmanager
+def selection_snapshot(context):
+    """Remembers the selected and active objects, and restores them when the block exits.
+    Meant to wrap a whole pipeline run, so the steps inside don't need to restore the selection themselves"""
+    selected_objects = list(context.selected_objects)
+    active_object = context.view_layer.objects.active
+    try:
+        yield
+    finally:
+        select_only(context, selected_objects)
+        if active_object is None or is_valid(active_object):
+            context.view_layer.objects.active = active_object
+
+
+def object_override(context, objects, active=None):
+    """Returns a context override that runs object operators on the given objects, without changing the
+    selection in the view layer. Use it as: with object_override(context, objects, active): bpy.ops..."""
+    objects = list(objects)
+    if active is None and len(objects) > 0:
+        active = objects[0]
+    return context.temp_override(selected_objects=objects, selected_editable_objects=objects,
+                                 active_object=active, object=active)
+
+
+def register():
+    pass
+
+
+def unregister():
+    pass
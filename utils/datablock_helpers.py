@@ -0,0 +1,130 @@
+# Copyright © 2024 GDCorner
+# This is licensed under the MIT license. See the LICENSE file for full details
+# https://choosealicense.com/licenses/mit/
+
+import bpy
+from contextlib import contextmanager
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# Bytes per element of each attribute type, used to estimate how much memory a mesh holds
+_ATTRIBUTE_TYPE_SIZES = {
+    'FLOAT': 4,
+    'INT': 4,
+    'INT8': 1,
+    'BOOLEAN': 1,
+    'FLOAT2': 8,
+    'INT32_2D': 8,
+    'FLOAT_VECTOR': 12,
+    'FLOAT_COLOR': 16,
+    'BYTE_COLOR': 4,
+    'QUATERNION': 16,
+    'FLOAT4X4': 64,
+}
+
+
+def estimate_mesh_memory(mesh_data):
+    """Returns a rough estimate of the bytes used by the geometry and attributes of a mesh"""
+    num_bytes = len(mesh_data.polygons) * 4
+    attribute_names = set()
+    for attribute in mesh_data.attributes:
+        attribute_names.add(attribute.name)
+        num_bytes += len(attribute.data) * _ATTRIBUTE_TYPE_SIZES.get(attribute.data_type, 4)
+    if 'position' not in attribute_names:
+        # Before Blender 3.5 the core geometry isn't stored as generic attributes
+        num_bytes += len(mesh_data.vertices) * 12 + len(mesh_data.edges) * 8 + len(mesh_data.loops) * 8
+    for uv_layer in mesh_data.uv_layers:
+        if uv_layer.name not in attribute_names:
+            num_bytes += len(mesh_data.loops) * 8
+    return num_bytes
+
+
+def estimate_datablock_memory(datablock):
+    if isinstance(datablock, bpy.types.Mesh):
+        return estimate_mesh_memory(datablock)
+    return 0
+
+
+def format_bytes(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+
+def is_valid(datablock):
+    # Datablocks and objects that have been removed raise a ReferenceError when accessed
+    try:
+        datablock.name
+    except ReferenceError:
+        return False
+    return True
+
+
+class OrphanCollector:
+    """Collects objects the pipeline is done with, and the meshes they leave behind, then frees them in bulk.
+    Everything is removed with a single bpy.data.batch_remove call for the objects and one for their data, instead
+    of deleting objects with operators and leaving their meshes orphaned in the file"""
+
+    def __init__(self):
+        self._objects = {}
+        self._data = {}
+        self.removed_count = 0
+        self.reclaimed_bytes = 0
+
+    def add_objects(self, objects):
+        """Marks the objects for removal. Their data is removed too, if nothing else uses it"""
+        for obj in objects:
+            self._objects[obj.as_pointer()] = obj
+            if obj.data is not None:
+                self._data[obj.data.as_pointer()] = obj.data
+
+    def add_data(self, datablocks):
+        """Marks datablocks to be removed, if nothing uses them any more by the time they're collected"""
+        for datablock in datablocks:
+            self._data[datablock.as_pointer()] = datablock
+
+    def collect(self):
+        """Removes the collected objects, then all the collected data without users.
+        Returns the number of datablocks removed and an estimate of the bytes reclaimed"""
+        objects = [obj for obj in self._objects.values() if is_valid(obj)]
+        self._objects.clear()
+        if len(objects) > 0:
+            bpy.data.batch_remove(objects)
+
+        orphans = [datablock for datablock in self._data.values() if is_valid(datablock) and datablock.users == 0]
+        self._data.clear()
+        reclaimed_bytes = sum(estimate_datablock_memory(datablock) for datablock in orphans)
+        if len(orphans) > 0:
+            bpy.data.batch_remove(orphans)
+
+        removed_count = len(objects) + len(orphans)
+        self.removed_count += removed_count
+        self.reclaimed_bytes += reclaimed_bytes
+        if removed_count > 0:
+            log.info(f"Removed {len(objects)} objects and {len(orphans)} orphaned datablocks, "
+                     f"reclaimed about {format_bytes(reclaimed_bytes)}")
+        return removed_count, reclaimed_bytes
+
+    @contextmanager
+    def collecting(self, datablocks=()):
+        """Frees what a pipeline stage leaves behind when the block exits: the given datablocks the stage replaces,
+        and any mesh created during the stage that ends up without users"""
+        existing_meshes = {mesh.as_pointer() for mesh in bpy.data.meshes}
+        self.add_data(datablocks)
+        try:
+            yield self
+        finally:
+            self.add_data([mesh for mesh in bpy.data.meshes if mesh.as_pointer() not in existing_meshes])
+            self.collect()
+
+
+def register():
+    pass
+
+
+def unregister():
+    pass
@@ -4,6 +4,8 @@
 
 import math
 
+import numpy as np
+
 
 # calculates the area of a triangle with usage of code
 # from the below source, obtained under the GPL license
@@ -19,20 +21,60 @@ def triangle_area(verts):
     return math.sqrt(cal)
 
 
-# calculates area of a quad with usage of code
-# from the below source, obtained under the GPL license
-# https://github.com/amb/blender-scripts/blob/master/uv_area.py
+# Calculates the area of a quad. Uses the shoelace formula, so concave quads are handled correctly
 def quad_area(verts):
-    return triangle_area(verts[:3]) + triangle_area(verts[2:] + [verts[0]])
+    return ngon_area(verts)
 
 
-# Calculates the area of an ngon. This will likely produce incorrect results on concave polygons
+# Calculates the area of a simple 2D polygon using the shoelace formula.
+# This is exact for concave polygons as well as convex ones
 def ngon_area(verts):
     area = 0
     num_sides = len(verts)
-    for i in range(num_sides - 2):
-        area += triangle_area([verts[0], verts[i + 1], verts[i + 2]])
-    return area
+    for i in range(num_sides):
+        curr_vert = verts[i]
+        next_vert = verts[(i + 1) % num_sides]
+        area += curr_vert[0] * next_vert[1] - next_vert[0] * curr_vert[1]
+    return abs(area) / 2
+
+
+# Returns the index of the next loop around the polygon for every loop, for polygons stored
+# as flat loop arrays. The last loop of each polygon wraps around to the first
+def next_loop_indices(loop_starts, loop_totals):
+    next_loops = np.arange(int(np.sum(loop_totals))) + 1
+    has_loops = loop_totals > 0
+    next_loops[(loop_starts + loop_totals - 1)[has_loops]] = loop_starts[has_loops]
+    return next_loops
+
+
+# Vectorised shoelace formula. coords is a (num_loops, 2) array holding the corners of all polygons,
+# with each polygon's corners stored from loop_starts[i] to loop_starts[i] + loop_totals[i].
+# Returns the area of every polygon. This is exact for any simple polygon, concave or not.
+# Polygons with less than 3 sides have no area, and NaN coordinates produce a NaN area
+def polygon_areas_2d(coords, loop_starts, loop_totals):
+    coords = np.asarray(coords, dtype=np.float64)
+    loop_polys = np.repeat(np.arange(len(loop_totals)), loop_totals)
+    # Measure relative to the first corner of each polygon to avoid precision loss far from the origin
+    local_coords = coords - coords[loop_starts[loop_polys]]
+    next_coords = local_coords[next_loop_indices(loop_starts, loop_totals)]
+    cross = local_coords[:, 0] * next_coords[:, 1] - next_coords[:, 0] * local_coords[:, 1]
+    return np.abs(np.bincount(loop_polys, weights=cross, minlength=len(loop_totals))) / 2
+
+
+# Vectorised polygon area in 3D using Newell's method, the 3D equivalent of the shoelace formula.
+# Takes the same flat arrays as polygon_areas_2d, with coords being (num_loops, 3).
+# This is exact for any planar simple polygon, concave or not
+def polygon_areas_3d(coords, loop_starts, loop_totals):
+    coords = np.asarray(coords, dtype=np.float64)
+    num_polys = len(loop_totals)
+    loop_polys = np.repeat(np.arange(num_polys), loop_totals)
+    local_coords = coords - coords[loop_starts[loop_polys]]
+    next_coords = local_coords[next_loop_indices(loop_starts, loop_totals)]
+    cross = np.cross(local_coords, next_coords)
+    normal_sums = np.empty((num_polys, 3))
+    for axis in range(3):
+        normal_sums[:, axis] = np.bincount(loop_polys, weights=cross[:, axis], minlength=num_polys)
+    return np.linalg.norm(normal_sums, axis=1) / 2
 
 
 def register():
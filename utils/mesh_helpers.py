@@ -4,124 +4,360 @@
 
 import bmesh
 import bpy
-import array
+import hashlib
 import logging
+import numpy as np
 
-from mathutils import Vector
-from . import message_helpers
+from mathutils import Matrix, Vector
+from . import context_helpers
+from . import math_helpers
+from . import timing_helpers
 
 log = logging.getLogger(__name__)
 
 
-# Copies a bmesh from an object
-# Copied under GPL from:
-# https://developer.blender.org/diffusion/BA/browse/master/object_print3d_utils/mesh_helpers.py
-def bmesh_copy_from_object(obj, transform=True, triangulate=True, apply_modifiers=False):
-    """Returns a transformed, triangulated copy of the mesh"""
+def get_face_areas(curr_object, apply_scaling=False, face_indices=None):
+    """Returns an array with the area of every face of the mesh, or of the faces in face_indices if given.
+    With apply_scaling the areas are measured in world space, from the loop arrays of the mesh and the
+    world matrix, without making a copy of the mesh"""
+    mesh_data = curr_object.data
+    num_polys = len(mesh_data.polygons)
+
+    if apply_scaling is False:
+        face_areas = np.empty(num_polys, dtype=np.float32)
+        mesh_data.polygons.foreach_get('area', face_areas)
+        face_areas = face_areas.astype(np.float64)
+        if face_indices is not None:
+            face_areas = face_areas[face_indices]
+        return face_areas
+
+    loop_starts = _read_mesh_array(mesh_data.polygons, 'loop_start', np.int64)
+    loop_totals = _read_mesh_array(mesh_data.polygons, 'loop_total', np.int64)
+    loop_verts = _read_mesh_array(mesh_data.loops, 'vertex_index', np.int64)
+    if face_indices is not None:
+        # Only measure the requested faces, packing their loops into new flat arrays
+        face_indices = np.asarray(face_indices, dtype=np.int64)
+        loop_starts = loop_starts[face_indices]
+        loop_totals = loop_totals[face_indices]
+        new_loop_starts = np.zeros_like(loop_totals)
+        new_loop_starts[1:] = np.cumsum(loop_totals)[:-1]
+        loop_offsets = np.arange(int(loop_totals.sum())) - np.repeat(new_loop_starts, loop_totals)
+        loop_verts = loop_verts[np.repeat(loop_starts, loop_totals) + loop_offsets]
+        loop_starts = new_loop_starts
+
+    vert_cos = _read_mesh_array(mesh_data.vertices, 'co', np.float32, 3)
+    # Translation doesn't change the area, so only the rotation and scale are applied
+    rot_scale = np.array(curr_object.matrix_world, dtype=np.float64)[:3, :3]
+    world_cos = vert_cos @ rot_scale.T
+
+    return math_helpers.polygon_areas_3d(world_cos[loop_verts], loop_starts, loop_totals)
 
-    assert obj.type == 'MESH'
 
-    if apply_modifiers and obj.modifiers:
-        depsgraph = bpy.context.evaluated_depsgraph_get()
-        obj_eval = obj.evaluated_get(depsgraph)
-        me = obj_eval.to_mesh()
-        bm = bmesh.new()
-        bm.from_mesh(me)
-        obj_eval.to_mesh_clear()
-    else:
-        me = obj.data
-        if obj.mode == 'EDIT':
-            bm_orig = bmesh.from_edit_mesh(me)
-            bm = bm_orig.copy()
-        else:
-            bm = bmesh.new()
-            bm.from_mesh(me)
-
-    # TODO. remove all customdata layers.
-    # would save ram
-
-    if transform:
-        bm.transform(obj.matrix_world)
-
-    if triangulate:
-        bmesh.ops.triangulate(bm, faces=bm.faces)
+def get_surface_area_of_mesh(curr_object, apply_scaling=False):
+    return float(get_face_areas(curr_object, apply_scaling).sum())
 
-    return bm
 
+def get_surface_area_of_faces_from_mesh(curr_object, face_list, apply_scaling=False):
+    face_indices = np.fromiter(face_list, dtype=np.int64)
+    return float(get_face_areas(curr_object, apply_scaling, face_indices).sum())
+
+
+def _hash_rna_properties(hasher, struct):
+    # Hash the values of all the simple properties of an RNA struct, such as a modifier
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == 'rna_type' or prop.type == 'COLLECTION':
+            continue
+        value = getattr(struct, prop.identifier, None)
+        if prop.type == 'POINTER':
+            value = getattr(value, 'name_full', None)
+        elif getattr(prop, 'is_array', False):
+            value = tuple(value)
+        hasher.update(f"{prop.identifier}={value!r};".encode())
+
+
+def get_mesh_fingerprint(curr_object, extra=(), include_scale=True):
+    """Returns a hash of the mesh geometry and topology, the modifier stack and the object scale.
+    Anything else that should invalidate the fingerprint, such as operator settings, can be passed in extra"""
+    mesh_data = curr_object.data
+    hasher = hashlib.blake2b(digest_size=16)
+
+    vert_cos = np.empty(len(mesh_data.vertices) * 3, dtype=np.float32)
+    mesh_data.vertices.foreach_get('co', vert_cos)
+    hasher.update(vert_cos.tobytes())
+
+    loop_verts = np.empty(len(mesh_data.loops), dtype=np.int32)
+    mesh_data.loops.foreach_get('vertex_index', loop_verts)
+    hasher.update(loop_verts.tobytes())
+
+    loop_totals = np.empty(len(mesh_data.polygons), dtype=np.int32)
+    mesh_data.polygons.foreach_get('loop_total', loop_totals)
+    hasher.update(loop_totals.tobytes())
+
+    for mod in curr_object.modifiers:
+        hasher.update(f"modifier:{mod.type}:{mod.name};".encode())
+        _hash_rna_properties(hasher, mod)
+
+    if include_scale:
+        hasher.update(repr(tuple(curr_object.scale)).encode())
+    hasher.update(repr(tuple(extra)).encode())
+
+    return hasher.hexdigest()
+
+
+def _hash_vertex_groups(hasher, obj, include_weights=True):
+    hasher.update(repr(obj.vertex_groups.keys()).encode())
+    if not include_weights or len(obj.vertex_groups) == 0:
+        return
+    # Vertex weights have no foreach access, so they have to be read per vertex
+    weights = [(vert.index, group_element.group, group_element.weight)
+               for vert in obj.data.vertices for group_element in vert.groups]
+    hasher.update(np.array(weights, dtype=np.float64).tobytes())
+
+
+def _hash_object_data(hasher, obj, include_vertex_weights=True):
+    # Hash everything the prep process reads from an object other than its name and transform.
+    # Prepped meshes only reference their materials, so the materials are hashed by name and not by content
+    hasher.update(f"object:{obj.type}:{obj.hide_render}:{obj.enable_auto_uv};".encode())
+    material_names = [slot.material.name_full if slot.material else None for slot in obj.material_slots]
+    hasher.update(repr(material_names).encode())
+    if obj.type != 'MESH' or obj.data is None:
+        return
+
+    mesh_data = obj.data
+    hasher.update(get_mesh_fingerprint(obj, include_scale=False).encode())
+    hasher.update(_read_mesh_array(mesh_data.polygons, 'material_index', np.int32).tobytes())
+    hasher.update(_read_mesh_array(mesh_data.polygons, 'use_smooth', bool).tobytes())
+    hasher.update(_read_mesh_array(mesh_data.edges, 'use_seam', bool).tobytes())
+    hasher.update(_read_mesh_array(mesh_data.edges, 'use_edge_sharp', bool).tobytes())
+    for uv_layer in mesh_data.uv_layers:
+        hasher.update(f"uv:{uv_layer.name};".encode())
+        hasher.update(_read_mesh_array(uv_layer.data, 'uv', np.float32, 2).tobytes())
+
+    has_custom_normals = has_custom_split_normals(mesh_data)
+    hasher.update(f"custom_normals:{has_custom_normals};".encode())
+    if has_custom_normals:
+        hasher.update(get_loop_normals(mesh_data).tobytes())
+
+    for attribute in mesh_data.attributes:
+        # Attributes starting with a dot are internal, such as the edit mode selection
+        if attribute.name.startswith('.') or attribute.data_type not in _ATTRIBUTE_BUFFER_TYPES:
+            continue
+        prop_name, dtype, num_components = _ATTRIBUTE_BUFFER_TYPES[attribute.data_type]
+        hasher.update(f"attribute:{attribute.name}:{attribute.domain}:{attribute.data_type};".encode())
+        hasher.update(_read_mesh_array(attribute.data, prop_name, dtype, num_components).tobytes())
+
+    _hash_vertex_groups(hasher, obj, include_vertex_weights)
+
+
+def get_objects_fingerprint(objects, extra=()):
+    """Returns a hash of everything the prep process reads from a group of source objects: the mesh data,
+    modifiers, world transforms, material names, face material indices and smoothing, sharp
+    edges and seams, uvs, custom split normals, generic attributes, vertex groups and the auto uv and
+    render visibility flags. The objects are hashed in name order, so the order they're passed in doesn't matter"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for obj in sorted(objects, key=lambda o: o.name):
+        hasher.update(f"name:{obj.name};".encode())
+        hasher.update(np.array(obj.matrix_world, dtype=np.float32).tobytes())
+        _hash_object_data(hasher, obj)
+
+    hasher.update(repr(tuple(extra)).encode())
+    return hasher.hexdigest()
+
+
+def get_geometry_fingerprint(curr_object, extra=()):
+    """Returns a hash of the object data that doesn't depend on the object name or transform, so identical parts
+    placed at different locations, or mirrored, have the same fingerprint. Vertex weights are left out, as reading
+    them is slow and the rig replaces the vertex groups of the wheels anyway"""
+    hasher = hashlib.blake2b(digest_size=16)
+    _hash_object_data(hasher, curr_object, include_vertex_weights=False)
+    hasher.update(repr(tuple(extra)).encode())
+    return hasher.hexdigest()
+
+
+def transform_mesh_data(objects, matrices):
+    """Transforms the mesh data of each object by the matching matrix, directly on the data.
+    Objects that share mesh data with the same matrix are only transformed once. If the matrices differ, or the
+    mesh is also used by objects outside this batch, the objects get their own copy of the mesh first.
+    Face winding is flipped in the same pass for matrices with a negative determinant"""
+    # Group the objects by their mesh data, then by matrix
+    mesh_groups = {}
+    for obj, matrix in zip(objects, matrices):
+        if obj.data is None:
+            continue
+        matrix_groups = mesh_groups.setdefault(obj.data.as_pointer(), [])
+        for group_matrix, group_objects in matrix_groups:
+            if group_matrix == matrix:
+                group_objects.append(obj)
+                break
+        else:
+            matrix_groups.append((matrix, [obj]))
+
+    for matrix_groups in mesh_groups.values():
+        mesh_data = matrix_groups[0][1][0].data
+        num_batch_users = sum(len(group_objects) for _, group_objects in matrix_groups)
+        # Make every copy before any transform is applied, so each copy starts from the original data
+        group_meshes = []
+        for group_idx, (matrix, group_objects) in enumerate(matrix_groups):
+            group_mesh_data = mesh_data
+            if group_idx > 0 or mesh_data.users > num_batch_users:
+                group_mesh_data = mesh_data.copy()
+                for obj in group_objects:
+                    obj.data = group_mesh_data
+            group_meshes.append((matrix, group_mesh_data))
+
+        for matrix, group_mesh_data in group_meshes:
+            group_mesh_data.transform(matrix, shape_keys=True)
+            if matrix.is_negative:
+                group_mesh_data.flip_normals()
 
-# Calculates the area of a bmesh
-# Copied under GPL from:
-# https://developer.blender.org/diffusion/BA/browse/master/object_print3d_utils/mesh_helpers.py
-def bmesh_calc_area(bm):
-    """Calculate the surface area."""
-    return sum(f.calc_area() for f in bm.faces)
 
+def apply_all_transforms(context, meshes):
+    # Apply all transforms to the mesh data, and reset the object transforms
+    meshes = [obj for obj in meshes if obj.data is not None]
+    transform_mesh_data(meshes, [obj.matrix_basis.copy() for obj in meshes])
+    for obj in meshes:
+        obj.matrix_basis = Matrix.Identity(4)
 
-# Calculates the area of specific faces in a bmesh
-# Adapted under GPL from:
-# https://developer.blender.org/diffusion/BA/browse/master/object_print3d_utils/mesh_helpers.py
-def bmesh_calc_area_of_faces(bm, face_list):
-    """Calculate the surface area."""
-    if hasattr(bm.faces, "ensure_lookup_table"):
-        bm.faces.ensure_lookup_table()
-    faces = [bm.faces[i] for i in face_list]
-    return sum(f.calc_area() for f in faces)
 
+def _apply_modifiers_with_operator(context, ob):
+    # Fallback for objects that aren't part of the evaluated depsgraph, such as objects hidden in the viewport
+    with context_helpers.object_override(context, [ob], ob):
+        for mod in ob.modifiers:
+            try:
+                timing_helpers.count_ops_calls()
+                bpy.ops.object.modifier_apply(modifier=mod.name)
+            except RuntimeError:
+                # Modifier is likely disabled, remove it
+                log.error(f'Unable to apply modifier. Likely disabled, deleting it instead. OBJ: {ob.name}, MOD: {mod.name}')
+                timing_helpers.count_ops_calls()
+                bpy.ops.object.modifier_remove(modifier=mod.name)
 
-def get_surface_area_of_mesh(curr_object, apply_scaling=False):
-    face_total_world_area = 0
-
-    if apply_scaling == False:
-        for face_idx in range(len(curr_object.data.polygons)):
-            face_total_world_area += curr_object.data.polygons[face_idx].area
-    else:
-        bm = bmesh_copy_from_object(curr_object, apply_modifiers=False, triangulate=False)
-        face_total_world_area = bmesh_calc_area(bm)
-        bm.free()
 
-    return face_total_world_area
+def apply_all_modifiers(context, meshes):
+    """Bakes the modifier stack of every object into its mesh data.
+    The depsgraph is evaluated once for the whole batch, and each object gets a new mesh built from its evaluated
+    result. Modifiers disabled in the viewport aren't part of that result, so they are skipped and removed.
+    Returns a dict of object names to the names of the modifiers that were skipped"""
+    objects_with_modifiers = [ob for ob in meshes if ob.type == 'MESH' and len(ob.modifiers) > 0]
+    if len(objects_with_modifiers) == 0:
+        return {}
+
+    depsgraph = context.evaluated_depsgraph_get()
+    skipped_modifiers = {}
+    baked_meshes = []
+    for ob in objects_with_modifiers:
+        ob_eval = ob.evaluated_get(depsgraph)
+        if not ob_eval.is_evaluated:
+            _apply_modifiers_with_operator(context, ob)
+            continue
+        skipped = [mod.name for mod in ob.modifiers if not mod.show_viewport]
+        if len(skipped) > 0:
+            skipped_modifiers[ob.name] = skipped
+        baked_meshes.append((ob, bpy.data.meshes.new_from_object(ob_eval, preserve_all_data_layers=True, depsgraph=depsgraph)))
+
+    # Swap the meshes in only after every object has been evaluated, so modifiers that reference
+    # other objects in the batch see them in their original state
+    for ob, baked_mesh in baked_meshes:
+        original_mesh = ob.data
+        mesh_name = original_mesh.name
+        ob.modifiers.clear()
+        ob.data = baked_mesh
+        if original_mesh.users == 0:
+            bpy.data.meshes.remove(original_mesh)
+        baked_mesh.name = mesh_name
+
+    if len(skipped_modifiers) > 0:
+        skipped_list = ", ".join(f"{ob_name}: {', '.join(mod_names)}" for ob_name, mod_names in skipped_modifiers.items())
+        log.warning(f"Disabled modifiers were skipped and removed. {skipped_list}")
+
+    return skipped_modifiers
+
+
+# Blender 4.1 removed calc_normals_split and auto smooth, loop normals are always up to date from then on.
+# Check for these once instead of on every call
+_HAS_CALC_NORMALS_SPLIT = 'calc_normals_split' in bpy.types.Mesh.bl_rna.functions
+_HAS_AUTO_SMOOTH = 'use_auto_smooth' in bpy.types.Mesh.bl_rna.properties
+
+
+def new_mesh_from_evaluated_object(context, curr_object, depsgraph=None):
+    """Returns a new mesh with the modifiers and world transform of the object baked in. It's built straight from
+    the evaluated object, so the original mesh is never copied first. The new mesh keeps the material list of the
+    evaluated mesh, including materials added by modifiers, with the object linked materials stored in their slots.
+    Returns None for objects that aren't part of the evaluated depsgraph"""
+    if depsgraph is None:
+        depsgraph = context.evaluated_depsgraph_get()
+    obj_eval = curr_object.evaluated_get(depsgraph)
+    if not obj_eval.is_evaluated:
+        return None
+
+    mesh_data = bpy.data.meshes.new_from_object(obj_eval, preserve_all_data_layers=True, depsgraph=depsgraph)
+    # Object linked slots override the material of the evaluated mesh at the same index
+    for slot_idx, slot in enumerate(curr_object.material_slots):
+        if slot.link == 'OBJECT' and slot_idx < len(mesh_data.materials):
+            mesh_data.materials[slot_idx] = slot.material
+
+    mesh_data.transform(curr_object.matrix_world)
+    if curr_object.matrix_world.is_negative:
+        mesh_data.flip_normals()
+    return mesh_data
+
+
+class ProcessingLedger:
+    """Remembers which processing steps have been applied to which objects during a prep run, so each step is
+    applied at most once per object however many stages the object passes through"""
+    MODIFIERS = 'modifiers'
+    TRANSFORMS = 'transforms'
+    UVS = 'uvs'
+
+    def __init__(self):
+        self._applied_steps = {}
+
+    def is_applied(self, obj, step):
+        return step in self._applied_steps.get(obj.as_pointer(), ())
+
+    def pending(self, objects, step):
+        """Returns the objects that haven't had the step applied yet"""
+        return [obj for obj in objects if not self.is_applied(obj, step)]
+
+    def mark_applied(self, objects, step):
+        for obj in objects:
+            self._applied_steps.setdefault(obj.as_pointer(), set()).add(step)
 
+    def get_steps_applied_to_all(self, objects):
+        """Returns the steps that have been applied to every one of the objects"""
+        steps = None
+        for obj in objects:
+            obj_steps = self._applied_steps.get(obj.as_pointer(), set())
+            steps = set(obj_steps) if steps is None else steps & obj_steps
+        return steps or set()
 
-def get_surface_area_of_faces_from_mesh(curr_object, face_list, apply_scaling=False):
-    face_total_world_area = 0
-
-    if apply_scaling == False:
-        for face_idx in face_list:
-            face_total_world_area += curr_object.data.polygons[face_idx].area
-    else:
-        bm = bmesh_copy_from_object(curr_object, apply_modifiers=False, triangulate=False)
-        face_total_world_area = bmesh_calc_area_of_faces(bm, face_list)
-        bm.free()
+    def forget(self, objects):
+        # Objects about to be removed, so a new object reusing the same memory doesn't inherit their steps
+        for obj in objects:
+            self._applied_steps.pop(obj.as_pointer(), None)
 
-    return face_total_world_area
 
+def get_loop_normals(mesh_data):
+    """Returns the normal of every loop as a contiguous (num_loops, 3) float32 array"""
+    if _HAS_CALC_NORMALS_SPLIT:
+        mesh_data.calc_normals_split()
+    loop_normals = np.empty(len(mesh_data.loops) * 3, dtype=np.float32)
+    mesh_data.loops.foreach_get('normal', loop_normals)
+    return loop_normals.reshape(-1, 3)
 
-def apply_all_transforms(context, meshes):
-    # Apply all transforms to selected object
-    bpy.ops.object.select_all(action='DESELECT')
-    for obj in meshes:
-        obj.select_set(True)
-        context.view_layer.objects.active = obj
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-        obj.select_set(False)
 
+def has_custom_split_normals(mesh_data):
+    if not mesh_data.has_custom_normals:
+        return False
+    # Before Blender 4.1 custom normals are ignored unless auto smooth is enabled
+    return not _HAS_AUTO_SMOOTH or mesh_data.use_auto_smooth
 
-def apply_all_modifiers(context, meshes):
-    # Deselect all objects
-    bpy.ops.object.select_all(action='DESELECT')
 
-    # bpy.ops.object.apply_all_modifiers()
-    for ob in meshes:
-        ob.select_set(True)
-        context.view_layer.objects.active = ob
-        for mod in ob.modifiers:
-            try:
-                bpy.ops.object.modifier_apply(modifier=mod.name)
-            except:
-                # Modifier is likely disabled, remove it
-                log.error(logging.ERROR, f'Unable to apply modifier. Likely disable, deleting it instead. OBJ: {ob.name}, MOD: {mod.name}')
-                bpy.ops.object.modifier_remove(modifier=mod.name)
-        ob.select_set(False)
+def set_custom_split_normals(mesh_data, loop_normals):
+    mesh_data.normals_split_custom_set(np.ascontiguousarray(loop_normals, dtype=np.float32).reshape(-1, 3))
+    # Enable the use custom split normals data
+    if _HAS_AUTO_SMOOTH:
+        mesh_data.use_auto_smooth = True
 
 
 # https://github.com/Aadjou/blender-scripts/blob/master/utils_split_normals.py
@@ -129,91 +365,413 @@ def apply_all_modifiers(context, meshes):
 def apply_split_normals(obj):
     # Write the blender internal smoothing as custom split vertex normals
     me = obj.data
-    try:
-        me.calc_normals_split()
-    except AttributeError:
-        # Probably in blender 4.1 and above
-        pass
-    cl_nors = array.array('f', [0.0] * (len(me.loops) * 3))
-    me.loops.foreach_get('normal', cl_nors)
-    # me.polygons.foreach_set('use_smooth', [False] * len(me.polygons))
-    nors_split_set = tuple(zip(*(iter(cl_nors),) * 3))
-    me.normals_split_custom_set(nors_split_set)
-    # Enable the use custom split normals data
-    try:
-        me.use_auto_smooth = True
-    except AttributeError:
-        # Probably in blender 4.1 and above
-        pass
+    if has_custom_split_normals(me):
+        # The current normals are already custom normals, so writing them again wouldn't change anything
+        return
+    set_custom_split_normals(me, get_loop_normals(me))
+
+
+# Generic attributes that merge_meshes_into copies through their own mesh properties instead
+_MERGE_SKIPPED_ATTRIBUTES = {'position', 'material_index', 'sharp_face', 'sharp_edge', 'normal', 'custom_normal'}
+
+# The foreach property, numpy type and number of components used to copy each kind of generic attribute
+_ATTRIBUTE_BUFFER_TYPES = {
+    'FLOAT': ('value', np.float32, 1),
+    'INT': ('value', np.int32, 1),
+    'INT8': ('value', np.int32, 1),
+    'BOOLEAN': ('value', bool, 1),
+    'FLOAT2': ('vector', np.float32, 2),
+    'FLOAT_VECTOR': ('vector', np.float32, 3),
+    'FLOAT_COLOR': ('color', np.float32, 4),
+    'BYTE_COLOR': ('color', np.float32, 4),
+}
+
+# Blender 4.0 derives loop_total from loop_start, so it can no longer be written
+_CAN_SET_LOOP_TOTAL = not bpy.types.MeshPolygon.bl_rna.properties['loop_total'].is_readonly
+
+
+def _get_domain_size(mesh_data, domain):
+    if domain == 'POINT':
+        return len(mesh_data.vertices)
+    if domain == 'EDGE':
+        return len(mesh_data.edges)
+    if domain == 'FACE':
+        return len(mesh_data.polygons)
+    if domain == 'CORNER':
+        return len(mesh_data.loops)
+    return None
+
+
+def _read_mesh_array(collection, prop_name, dtype, num_components=1):
+    values = np.empty(len(collection) * num_components, dtype=dtype)
+    collection.foreach_get(prop_name, values)
+    if num_components > 1:
+        return values.reshape(-1, num_components)
+    return values
+
+
+def _get_used_material_slots(curr_object):
+    """Returns the face material indices of the object, clipped to its slots the way Blender reads them,
+    and the sorted indices of the slots that faces use"""
+    material_indices = _read_mesh_array(curr_object.data.polygons, 'material_index', np.int32)
+    num_slots = len(curr_object.material_slots)
+    if num_slots == 0:
+        return np.zeros_like(material_indices), np.zeros(0, dtype=np.int64)
+    # Faces can point past the last slot, Blender treats those as using the last slot
+    material_indices = np.clip(material_indices, 0, num_slots - 1)
+    used_slots = np.flatnonzero(np.bincount(material_indices, minlength=num_slots))
+    return material_indices, used_slots
+
+
+def remove_unused_material_slots(curr_object):
+    """Moves the faces of every slot to the first slot with the same material, then removes all the slots no face
+    uses, the same as de-duplicating the slots and running bpy.ops.object.material_slot_remove_unused"""
+    num_slots = len(curr_object.material_slots)
+    if num_slots == 0:
+        return
+
+    first_slot_for_material = {}
+    first_slots = np.empty(num_slots, dtype=np.int32)
+    for slot_idx, slot in enumerate(curr_object.material_slots):
+        first_slots[slot_idx] = first_slot_for_material.setdefault(slot.material, slot_idx)
+
+    material_indices, _ = _get_used_material_slots(curr_object)
+    used_slots = np.zeros(num_slots, dtype=bool)
+    used_slots[first_slots[material_indices]] = True
+    kept_slots = np.flatnonzero(used_slots)
+    if len(kept_slots) == num_slots:
+        # No duplicates and no unused slots
+        return
+
+    new_slot_indices = np.zeros(num_slots, dtype=np.int32)
+    new_slot_indices[kept_slots] = np.arange(len(kept_slots))
+    rebuild_material_slots(curr_object, kept_slots.tolist(), new_slot_indices[first_slots])
+
+
+# Before Blender 4.0 bevel weights and creases aren't generic attributes, and merge_meshes_into can't copy them
+_HAS_LEGACY_CREASE_LAYERS = 'has_bevel_weight_vertex' in bpy.types.Mesh.bl_rna.properties
+_LEGACY_CREASE_LAYER_PROPERTIES = ('has_bevel_weight_vertex', 'has_bevel_weight_edge', 'has_crease_vertex', 'has_crease_edge')
+
+
+def _needs_operator_join(sources):
+    # Vertex weights have no foreach access, reading them one vertex at a time is far slower than the join operator
+    for source in sources:
+        if len(source.vertex_groups) > 0:
+            return True
+        if _HAS_LEGACY_CREASE_LAYERS and any(getattr(source.data, prop, False) for prop in _LEGACY_CREASE_LAYER_PROPERTIES):
+            return True
+    return False
+
+
+def _join_with_operator(context, target_object, sources, bake_normals):
+    if bake_normals:
+        for source in sources:
+            apply_split_normals(source)
+    with context_helpers.object_override(context, sources, target_object):
+        bpy.ops.object.join()
+    timing_helpers.count_ops_calls()
+    remove_unused_material_slots(target_object)
+
+
+def merge_meshes_into(context, target_object, objects, bake_normals=True):
+    """Merges the meshes of all the objects into target_object, the same as bpy.ops.object.join with
+    target_object active, but working directly on the mesh data so it doesn't depend on the selection.
+    Vertices, edges, faces, UVs, generic attributes and material indices are concatenated into a single new mesh
+    with foreach_set. Only the materials faces use get a slot, and every material only gets one slot, the same as
+    de-duplicating the slots and removing the unused ones after a join. With bake_normals the loop normals of
+    every input are kept as custom split normals. All the other objects are removed.
+    Meshes with vertex groups, or with bevel weight or crease layers before Blender 4.0, are joined with the
+    join operator through a context override instead. Returns the target object"""
+    sources = [target_object] + [obj for obj in objects
+                                 if obj != target_object and obj.type == 'MESH' and obj.data is not None]
+    if _needs_operator_join(sources):
+        _join_with_operator(context, target_object, sources, bake_normals)
+        return target_object
+
+    target_inverse = np.array(target_object.matrix_world.inverted_safe(), dtype=np.float64)
+
+    # Work out the combined layout of all the inputs
+    materials = []
+    material_slot_lookup = {}
+    source_material_indices = []
+    uv_layer_names = []
+    attribute_specs = {}
+    for source in sources:
+        mesh_data = source.data
+        material_indices, used_slots = _get_used_material_slots(source)
+        # Faces on unused slots don't exist, so those slots can map anywhere
+        slot_remap = np.zeros(max(len(source.material_slots), 1), dtype=np.int32)
+        for slot_idx in used_slots.tolist():
+            material = source.material_slots[slot_idx].material
+            if material not in material_slot_lookup:
+                material_slot_lookup[material] = len(materials)
+                materials.append(material)
+            slot_remap[slot_idx] = material_slot_lookup[material]
+        source_material_indices.append(slot_remap[material_indices])
+
+        for uv_layer in mesh_data.uv_layers:
+            if uv_layer.name not in uv_layer_names:
+                uv_layer_names.append(uv_layer.name)
+        for attribute in mesh_data.attributes:
+            if attribute.name.startswith('.') or attribute.name in _MERGE_SKIPPED_ATTRIBUTES:
+                continue
+            if attribute.data_type not in _ATTRIBUTE_BUFFER_TYPES:
+                continue
+            spec = (attribute.domain, attribute.data_type)
+            if attribute_specs.setdefault(attribute.name, spec) != spec:
+                log.warning(f"Attribute {attribute.name} on {source.name} doesn't match the other meshes, it won't be merged")
+    for uv_layer_name in uv_layer_names:
+        attribute_specs.pop(uv_layer_name, None)
+
+    counts = np.array([(len(source.data.vertices), len(source.data.edges), len(source.data.loops), len(source.data.polygons))
+                       for source in sources], dtype=np.int64).reshape(-1, 4)
+    offsets = np.zeros_like(counts)
+    offsets[1:] = np.cumsum(counts, axis=0)[:-1]
+    num_verts, num_edges, num_loops, num_polys = counts.sum(axis=0).tolist()
+
+    vert_cos = np.empty((num_verts, 3), dtype=np.float32)
+    edge_verts = np.empty((num_edges, 2), dtype=np.int32)
+    edge_seams = np.empty(num_edges, dtype=bool)
+    edge_sharp = np.empty(num_edges, dtype=bool)
+    loop_verts = np.empty(num_loops, dtype=np.int32)
+    loop_edges = np.empty(num_loops, dtype=np.int32)
+    loop_normals = np.empty((num_loops, 3), dtype=np.float32) if bake_normals else None
+    poly_loop_starts = np.empty(num_polys, dtype=np.int32)
+    poly_loop_totals = np.empty(num_polys, dtype=np.int32)
+    poly_smooth = np.empty(num_polys, dtype=bool)
+    poly_materials = np.empty(num_polys, dtype=np.int32)
+    uv_coords = {name: np.zeros((num_loops, 2), dtype=np.float32) for name in uv_layer_names}
+    domain_totals = {'POINT': num_verts, 'EDGE': num_edges, 'FACE': num_polys, 'CORNER': num_loops}
+    attribute_values = {}
+    for name, (domain, data_type) in attribute_specs.items():
+        _, dtype, num_components = _ATTRIBUTE_BUFFER_TYPES[data_type]
+        shape = (domain_totals[domain], num_components) if num_components > 1 else domain_totals[domain]
+        attribute_values[name] = np.zeros(shape, dtype=dtype)
+
+    for source_idx, source in enumerate(sources):
+        mesh_data = source.data
+        vert_offset, edge_offset, loop_offset, poly_offset = offsets[source_idx].tolist()
+        source_verts, source_edges, source_loops, source_polys = counts[source_idx].tolist()
+        vert_range = slice(vert_offset, vert_offset + source_verts)
+        edge_range = slice(edge_offset, edge_offset + source_edges)
+        loop_range = slice(loop_offset, loop_offset + source_loops)
+        poly_range = slice(poly_offset, poly_offset + source_polys)
+
+        # Move the geometry into the local space of the target
+        matrix = target_inverse @ np.array(source.matrix_world, dtype=np.float64)
+        rot_scale = matrix[:3, :3]
+        cos = _read_mesh_array(mesh_data.vertices, 'co', np.float32, 3)
+        vert_cos[vert_range] = cos @ rot_scale.T + matrix[:3, 3]
+
+        edge_verts[edge_range] = _read_mesh_array(mesh_data.edges, 'vertices', np.int32, 2) + vert_offset
+        edge_seams[edge_range] = _read_mesh_array(mesh_data.edges, 'use_seam', bool)
+        edge_sharp[edge_range] = _read_mesh_array(mesh_data.edges, 'use_edge_sharp', bool)
+        loop_verts[loop_range] = _read_mesh_array(mesh_data.loops, 'vertex_index', np.int32) + vert_offset
+        loop_edges[loop_range] = _read_mesh_array(mesh_data.loops, 'edge_index', np.int32) + edge_offset
+        poly_loop_starts[poly_range] = _read_mesh_array(mesh_data.polygons, 'loop_start', np.int32) + loop_offset
+        poly_loop_totals[poly_range] = _read_mesh_array(mesh_data.polygons, 'loop_total', np.int32)
+        poly_smooth[poly_range] = _read_mesh_array(mesh_data.polygons, 'use_smooth', bool)
+        poly_materials[poly_range] = source_material_indices[source_idx]
+
+        if bake_normals:
+            # Normals transform by the inverse transpose. pinv keeps this working for sources scaled to zero on an axis
+            normals = get_loop_normals(mesh_data).astype(np.float64) @ np.linalg.pinv(rot_scale)
+            lengths = np.linalg.norm(normals, axis=1)
+            lengths[lengths == 0] = 1
+            loop_normals[loop_range] = normals / lengths[:, None]
+
+        for uv_layer in mesh_data.uv_layers:
+            uv_coords[uv_layer.name][loop_range] = _read_mesh_array(uv_layer.data, 'uv', np.float32, 2)
+
+        for attribute in mesh_data.attributes:
+            if attribute.name not in attribute_values or (attribute.domain, attribute.data_type) != attribute_specs[attribute.name]:
+                continue
+            prop_name, dtype, num_components = _ATTRIBUTE_BUFFER_TYPES[attribute.data_type]
+            domain_offset = {'POINT': vert_offset, 'EDGE': edge_offset, 'FACE': poly_offset, 'CORNER': loop_offset}[attribute.domain]
+            domain_size = _get_domain_size(mesh_data, attribute.domain)
+            attribute_values[attribute.name][domain_offset:domain_offset + domain_size] = \
+                _read_mesh_array(attribute.data, prop_name, dtype, num_components)
+
+    # Build the merged mesh
+    original_mesh = target_object.data
+    merged_mesh = bpy.data.meshes.new(original_mesh.name)
+    merged_mesh.vertices.add(num_verts)
+    merged_mesh.vertices.foreach_set('co', vert_cos.reshape(-1))
+    merged_mesh.edges.add(num_edges)
+    merged_mesh.edges.foreach_set('vertices', edge_verts.reshape(-1))
+    merged_mesh.loops.add(num_loops)
+    merged_mesh.loops.foreach_set('vertex_index', loop_verts)
+    merged_mesh.loops.foreach_set('edge_index', loop_edges)
+    merged_mesh.polygons.add(num_polys)
+    merged_mesh.polygons.foreach_set('loop_start', poly_loop_starts)
+    if _CAN_SET_LOOP_TOTAL:
+        merged_mesh.polygons.foreach_set('loop_total', poly_loop_totals)
+    merged_mesh.polygons.foreach_set('use_smooth', poly_smooth)
+    merged_mesh.polygons.foreach_set('material_index', poly_materials)
+    merged_mesh.edges.foreach_set('use_seam', edge_seams)
+    merged_mesh.edges.foreach_set('use_edge_sharp', edge_sharp)
+    merged_mesh.update()
+
+    for material in materials:
+        merged_mesh.materials.append(material)
+
+    for uv_layer_name in uv_layer_names:
+        uv_layer = merged_mesh.uv_layers.new(name=uv_layer_name)
+        uv_layer.data.foreach_set('uv', uv_coords[uv_layer_name].reshape(-1))
+    if original_mesh.uv_layers.active is not None:
+        merged_mesh.uv_layers.active = merged_mesh.uv_layers[original_mesh.uv_layers.active.name]
+
+    for name, (domain, data_type) in attribute_specs.items():
+        attribute = merged_mesh.attributes.get(name)
+        if attribute is None:
+            attribute = merged_mesh.attributes.new(name=name, type=data_type, domain=domain)
+        prop_name, _, _ = _ATTRIBUTE_BUFFER_TYPES[data_type]
+        attribute.data.foreach_set(prop_name, attribute_values[name].reshape(-1))
+
+    if bake_normals:
+        set_custom_split_normals(merged_mesh, loop_normals)
+
+    # Swap the merged mesh in, and point every material slot at the merged materials
+    target_object.data = merged_mesh
+    for slot in target_object.material_slots:
+        slot.link = 'DATA'
+
+    # Remove the merged objects and any meshes left without users
+    mesh_name = original_mesh.name
+    old_meshes = {original_mesh.as_pointer(): original_mesh}
+    for source in sources[1:]:
+        old_meshes[source.data.as_pointer()] = source.data
+        bpy.data.objects.remove(source)
+    for old_mesh in old_meshes.values():
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
+    merged_mesh.name = mesh_name
+
+    return target_object
+
+
+def set_origin_to_bounds_center(curr_object):
+    """Moves the origin of an object to the center of its geometry bounds, without moving the geometry"""
+    mesh_data = curr_object.data
+    if len(mesh_data.vertices) == 0:
+        return
+    vert_cos = _read_mesh_array(mesh_data.vertices, 'co', np.float32, 3)
+    bounds_center = Vector(((vert_cos.min(axis=0) + vert_cos.max(axis=0)) / 2).tolist())
+    mesh_data.transform(Matrix.Translation(-bounds_center))
+    curr_object.matrix_world = curr_object.matrix_world @ Matrix.Translation(bounds_center)
 
 
 def fix_negative_scales(objects):
-    bpy.ops.object.select_all(action='DESELECT')
-    for obj in objects:
-        obj.select_set(False)
-
-    # Force selection update
-    bpy.context.view_layer.update()
+    negative_scale_objects = []
     for obj in objects:
         if obj.scale.x < 0 or obj.scale.y < 0 or obj.scale.z < 0:
-            obj.select_set(True)
             # Show warning dialog to user
             log.warning("Negative scale detected on object: " + obj.name + ". Negative scales can produce unexpected results. Recommend removing or fixing the negative scale before prep process")
+            if obj.data:
+                negative_scale_objects.append(obj)
 
+    # Apply the scale to the mesh data, flipping the normals in the same pass
+    transform_mesh_data(negative_scale_objects, [Matrix.Diagonal(obj.scale).to_4x4() for obj in negative_scale_objects])
+    for obj in negative_scale_objects:
+        obj.scale = (1.0, 1.0, 1.0)
 
-            # Apply the scale operator
-            bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
 
-            # Flip the normals on the mesh
-            if obj.data:
-                obj.data.flip_normals()
-            obj.select_set(False)
+def rebuild_material_slots(obj, kept_slots, slot_remap):
+    """Rebuilds the material slots of an object, keeping only the old slot indices in kept_slots, in that order.
+    slot_remap maps every old slot index to the new slot index its faces should use. The face material indices
+    are read and written back once, instead of going through the material slot operators"""
+    mesh_data = obj.data
+    material_indices, _ = _get_used_material_slots(obj)
+
+    # Remember how every slot is linked, as clearing the mesh materials resets the object's slots too
+    slot_states = [(slot.link, slot.material, mesh_data.materials[slot_idx])
+                   for slot_idx, slot in enumerate(obj.material_slots)]
+
+    mesh_data.materials.clear()
+    for old_slot_idx in kept_slots:
+        mesh_data.materials.append(slot_states[old_slot_idx][2])
+    for new_slot_idx, old_slot_idx in enumerate(kept_slots):
+        link, material, _ = slot_states[old_slot_idx]
+        if link == 'OBJECT':
+            obj.material_slots[new_slot_idx].link = 'OBJECT'
+            obj.material_slots[new_slot_idx].material = material
+
+    if len(slot_states) > 0:
+        material_indices = np.asarray(slot_remap, dtype=np.int32)[material_indices]
+        mesh_data.polygons.foreach_set('material_index', material_indices)
+        mesh_data.update()
 
 
 def remove_blank_materials(objects):
     # Blank material slots on meshes causes issues when importing an FBX into unreal, causing all kinds of material reassignment chaos
-    use_selected_slot_method = False
-    if bpy.app.version[0] >= 4 and bpy.app.version[1] >= 2:
-        # The API changed in Blender 4.2 to not take an object, rather just operates on the selected object
-        use_selected_slot_method = True
-        for obj in objects:
-            obj.select_set(False)
-
-    bpy.ops.object.select_all(action='DESELECT')
+    affected_objects = []
     for obj in objects:
-        for slot in obj.material_slots:
-            if slot.material is None:
-                message_helpers.show_warning_message(
-                    message="Blank material slot on object: " + obj.name + ". Blank material slots can cause material assignment issues in Unreal",
-                    title="Blank Material Slot Detected")
-                log.warning("Blank material slot on object: " + obj.name + ". Blank material slots can cause material assignment issues in Unreal")
-                obj.active_material_index = obj.material_slots.find(slot.name)
-                if use_selected_slot_method:
-                    bpy.ops.object.material_slot_remove()
-                else:
-                    bpy.ops.object.material_slot_remove({'object': obj})
+        if obj.data is None:
+            continue
+        blank_slots = np.array([slot.material is None for slot in obj.material_slots], dtype=bool)
+        if not blank_slots.any():
+            continue
+        affected_objects.append(obj.name)
+
+        # Faces on a removed slot move to the slot before it, matching how Blender removes material slots
+        removed_up_to_slot = np.cumsum(blank_slots)
+        slot_remap = np.maximum(np.arange(len(blank_slots)) - removed_up_to_slot, 0)
+        kept_slots = np.flatnonzero(~blank_slots).tolist()
+        rebuild_material_slots(obj, kept_slots, slot_remap)
+
+    if len(affected_objects) > 0:
+        log.warning("Blank material slots removed from objects: " + ", ".join(affected_objects) + ". Blank material slots can cause material assignment issues in Unreal")
+
+    return affected_objects
 
 
 def get_bounds_of_meshes(meshes):
-    # Open for writing and append
+    meshes = list(meshes)
+    num_meshes = len(meshes)
+    matrices = np.array([mesh.matrix_world for mesh in meshes], dtype=np.float64).reshape(num_meshes, 4, 4)
+    corners = np.array([mesh.bound_box for mesh in meshes], dtype=np.float64).reshape(num_meshes, 8, 3)
 
-    # Get the bounds of all meshes
-    xs = [(mesh.matrix_world @ Vector(vert))[0] for mesh in meshes for vert in mesh.bound_box]
-    ys = [(mesh.matrix_world @ Vector(vert))[1] for mesh in meshes for vert in mesh.bound_box]
-    zs = [(mesh.matrix_world @ Vector(vert))[2] for mesh in meshes for vert in mesh.bound_box]
+    # Transform the bound box corners of every mesh in one go
+    rot_scale = matrices[:, :3, :3]
+    translation = matrices[:, :3, 3]
+    world_corners = np.einsum('nij,nkj->nki', rot_scale, corners) + translation[:, None, :]
+    mins = world_corners.min(axis=1)
+    maxs = world_corners.max(axis=1)
 
-    min_x = min(xs)
-    max_x = max(xs)
-    min_y = min(ys)
-    max_y = max(ys)
-    min_z = min(zs)
-    max_z = max(zs)
+    min_x, min_y, min_z = mins.min(axis=0).tolist()
+    max_x, max_y, max_z = maxs.max(axis=0).tolist()
 
     absolute_bounds = ((min_x, min_y, min_z), (max_x, max_y, max_z))
 
     return absolute_bounds
 
 
+def get_world_vertex_coordinates(objects):
+    """Returns the world space positions of the vertices of all the mesh objects as a single (N, 3) array"""
+    coords = []
+    for obj in objects:
+        if obj.type != 'MESH' or obj.data is None:
+            continue
+        local_cos = _read_mesh_array(obj.data.vertices, 'co', np.float64, 3)
+        matrix = np.array(obj.matrix_world, dtype=np.float64)
+        coords.append(local_cos @ matrix[:3, :3].T + matrix[:3, 3])
+    if not coords:
+        return np.zeros((0, 3))
+    return np.concatenate(coords)
+
+
+def get_bounds_of_coordinates(coords, matrix=None):
+    """Returns the exact bounds of the coordinates, in the same form as get_bounds_of_meshes.
+    The coordinates are transformed by matrix first, if one is given"""
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) == 0:
+        return (0.0, 0.0, 0.0), (0.0, 0.0, 0.0)
+    if matrix is not None:
+        matrix = np.array(matrix, dtype=np.float64)
+        coords = coords @ matrix[:3, :3].T + matrix[:3, 3]
+    return tuple(coords.min(axis=0).tolist()), tuple(coords.max(axis=0).tolist())
+
+
 def get_x_size_of_bounds(bounds):
     return bounds[1][0] - bounds[0][0]
 
@@ -236,7 +794,7 @@ def get_center_of_meshes(meshes):
 
 
 def center_meshes_on_floor(context, meshes):
-    """Centers the meshes on the floor. Assumes the floor is at Z=0"""
+    """Centers the meshes on the floor. Assumes the floor is at Z=0. Returns the offset the meshes were moved by"""
     bounds = get_bounds_of_meshes(meshes)
     min_vert = bounds[0]
     max_vert = bounds[1]
@@ -251,36 +809,56 @@ def center_meshes_on_floor(context, meshes):
     for mesh in meshes:
         mesh.location += negative_location
 
+    return negative_location
 
-def delete_vertices_with_no_faces(mesh):
-    bpy.ops.object.select_all(action='DESELECT')
-    mesh.select_set(True)
-    bpy.context.view_layer.objects.active = mesh
-
-    # Switch to edit mode
-    bpy.ops.object.mode_set(mode='EDIT')
-
-    # Switch to vertex select mode
-    bpy.ops.mesh.select_mode(type="VERT")
 
-    # Select all vertices with no faces
-    bpy.ops.mesh.select_all(action='DESELECT')
-    bpy.ops.mesh.select_loose()
-    bpy.ops.mesh.delete(type='VERT')
-
-    bpy.ops.object.mode_set(mode='OBJECT')
+def delete_vertices_with_no_faces(mesh):
+    delete_vertices_with_no_faces_from_meshes([mesh])
 
 
 def delete_vertices_with_no_faces_from_meshes(meshes):
+    """Removes loose vertices and loose edges from the meshes, without entering edit mode.
+    Meshes without any loose geometry are left untouched"""
+    processed_mesh_data = set()
     for mesh in meshes:
-        delete_vertices_with_no_faces(mesh)
+        mesh_data = mesh.data
+        if mesh_data is None or mesh_data.as_pointer() in processed_mesh_data:
+            continue
+        processed_mesh_data.add(mesh_data.as_pointer())
+
+        num_loops = len(mesh_data.loops)
+        loop_verts = np.empty(num_loops, dtype=np.int32)
+        loop_edges = np.empty(num_loops, dtype=np.int32)
+        mesh_data.loops.foreach_get('vertex_index', loop_verts)
+        mesh_data.loops.foreach_get('edge_index', loop_edges)
+
+        # Anything that isn't used by a face loop is loose
+        loose_verts = np.flatnonzero(np.bincount(loop_verts, minlength=len(mesh_data.vertices)) == 0)
+        loose_edges = np.flatnonzero(np.bincount(loop_edges, minlength=len(mesh_data.edges)) == 0)
+        if len(loose_verts) == 0 and len(loose_edges) == 0:
+            continue
+
+        log.info(f"Removing {len(loose_verts)} loose vertices and {len(loose_edges)} loose edges from {mesh.name}")
+        bm = bmesh.new()
+        bm.from_mesh(mesh_data)
+        bm.verts.ensure_lookup_table()
+        bm.edges.ensure_lookup_table()
+        loose_geom = [bm.edges[i] for i in loose_edges.tolist()] + [bm.verts[i] for i in loose_verts.tolist()]
+        # Deleting edges also removes any of their vertices left without edges, as well as the tagged
+        # vertices that have no edges at all
+        bmesh.ops.delete(bm, geom=loose_geom, context='EDGES')
+        bm.to_mesh(mesh_data)
+        bm.free()
+        mesh_data.update()
 
 
 def clear_parents_keep_transforms_on_meshes(meshes):
-    bpy.ops.object.select_all(action='DESELECT')
-    for mesh in meshes:
-        mesh.select_set(True)
-    bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')
+    meshes = list(meshes)
+    if len(meshes) == 0:
+        return
+    with context_helpers.object_override(bpy.context, meshes):
+        bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')
+    timing_helpers.count_ops_calls()
 
 
 def register():
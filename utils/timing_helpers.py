@@ -0,0 +1,170 @@
+# Copyright © 2024 GDCorner
+# This is licensed under the MIT license. See the LICENSE file for full details
+# https://choosealicense.com/licenses/mit/
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import bpy
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# Number of runs kept in the rolling history file next to the export
+LEDGER_HISTORY_MAX_ENTRIES = 200
+
+_active_ledger = None
+
+
+class StageRecord:
+    """Timing and geometry cost of a single named pipeline stage"""
+
+    def __init__(self, name, depth, objects):
+        self.name = name
+        self.depth = depth
+        self.seconds = 0.0
+        self.ops_calls = 0
+        self.vertices_in, self.polygons_in = count_geometry(objects)
+        self.vertices_out = self.vertices_in
+        self.polygons_out = self.polygons_in
+        self._objects_out = None if objects is None else list(objects)
+
+    def set_output(self, objects):
+        """Sets the objects the stage produced, when they aren't the objects that went in"""
+        self._objects_out = None if objects is None else list(objects)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "depth": self.depth,
+            "seconds": round(self.seconds, 6),
+            "ops_calls": self.ops_calls,
+            "vertices_in": self.vertices_in,
+            "polygons_in": self.polygons_in,
+            "vertices_out": self.vertices_out,
+            "polygons_out": self.polygons_out,
+        }
+
+
+class StageLedger:
+    """Collects a StageRecord for every stage run while the ledger is active"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.start_time = time.perf_counter()
+        self.total_seconds = 0.0
+        self.ops_calls = 0
+        self.stages = []
+        self.depth = 0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "blender_version": bpy.app.version_string,
+            "total_seconds": round(self.total_seconds, 6),
+            "ops_calls": self.ops_calls,
+            "stages": [record.to_dict() for record in self.stages],
+        }
+
+    def write(self, export_dir, scene_filename):
+        """Writes the ledger as json next to the export manifest, and appends it to the rolling history file"""
+        self.total_seconds = time.perf_counter() - self.start_time
+        ledger_json = self.to_dict()
+
+        ledger_filename = os.path.join(export_dir, f'stage_ledger_{scene_filename}.json')
+        with open(ledger_filename, 'w') as outfile:
+            json.dump(ledger_json, outfile, indent=4)
+
+        history_filename = os.path.join(export_dir, 'stage_ledger_history.jsonl')
+        history = []
+        if os.path.exists(history_filename):
+            with open(history_filename, 'r') as infile:
+                history = [line for line in infile.read().splitlines() if line.strip()]
+        history.append(json.dumps(ledger_json))
+        with open(history_filename, 'w') as outfile:
+            outfile.write("\n".join(history[-LEDGER_HISTORY_MAX_ENTRIES:]) + "\n")
+
+        log.info(f"Wrote stage ledger to {ledger_filename}")
+        return ledger_filename
+
+
+def count_geometry(objects):
+    """Returns the total number of vertices and polygons of the mesh objects"""
+    num_vertices = 0
+    num_polygons = 0
+    for obj in objects or ():
+        try:
+            if obj.type != 'MESH' or obj.data is None:
+                continue
+            num_vertices += len(obj.data.vertices)
+            num_polygons += len(obj.data.polygons)
+        except ReferenceError:
+            # The object was removed during the stage
+            continue
+    return num_vertices, num_polygons
+
+
+def count_ops_calls(count=1):
+    """Adds bpy.ops calls to the active ledger. The pipeline calls this next to each of its own bpy.ops calls,
+    so operators run by anything else, such as other addons, aren't counted"""
+    if _active_ledger is not None:
+        _active_ledger.ops_calls += count
+
+
+def start_ledger(name):
+    """Starts recording stages into a new ledger, which becomes the active ledger"""
+    global _active_ledger
+    _active_ledger = StageLedger(name)
+    return _active_ledger
+
+
+def stop_ledger():
+    """Stops recording stages and returns the ledger that was active"""
+    global _active_ledger
+    ledger = _active_ledger
+    _active_ledger = None
+    if ledger is not None:
+        ledger.total_seconds = time.perf_counter() - ledger.start_time
+    return ledger
+
+
+def get_active_ledger():
+    return _active_ledger
+
+
+@contextmanager
+def stage(name, objects=None):
+    """Records the wall time, bpy.ops calls and geometry in and out of a pipeline stage in the active ledger.
+    Does nothing when no ledger is active. The output geometry is measured from the input objects, unless the stage
+    sets different ones with record.set_output"""
+    ledger = _active_ledger
+    if ledger is None:
+        yield StageRecord(name, 0, None)
+        return
+
+    record = StageRecord(name, ledger.depth, objects)
+    ledger.stages.append(record)
+    ledger.depth += 1
+    start_ops_calls = ledger.ops_calls
+    start_time = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start_time
+        record.ops_calls = ledger.ops_calls - start_ops_calls
+        record.vertices_out, record.polygons_out = count_geometry(record._objects_out)
+        ledger.depth -= 1
+
+
+def register():
+    pass
+
+
+def unregister():
+    pass
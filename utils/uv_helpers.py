@@ -4,8 +4,8 @@
 
 import math
 import bpy
-import bmesh
-import mathutils
+from collections import OrderedDict
+import numpy as np
 
 from . import math_helpers
 
@@ -21,11 +21,7 @@ def get_uv_area_for_poly(poly, uv_layer):
         if not math.isnan(val):
             return val
     else:
-        # This supports quads and ngons, but warns for ngons
-        if len(poly.loop_indices) > 4:
-            # print(
-            #    "Warning! Only quads or tris are fully supported, complex n-gons may produce incorrect area calculations")
-            pass
+        # This supports quads and ngons, including concave ones
         val = math_helpers.ngon_area([uv_layer[i].uv for i in poly.loop_indices])
         if not math.isnan(val):
             return val
@@ -34,109 +30,333 @@ def get_uv_area_for_poly(poly, uv_layer):
     return 0
 
 
+# Reads the loop_start and loop_total of every polygon into numpy arrays
+def get_polygon_loop_ranges(mesh_data):
+    num_polys = len(mesh_data.polygons)
+    loop_starts = np.empty(num_polys, dtype=np.int32)
+    loop_totals = np.empty(num_polys, dtype=np.int32)
+    mesh_data.polygons.foreach_get('loop_start', loop_starts)
+    mesh_data.polygons.foreach_get('loop_total', loop_totals)
+    return loop_starts, loop_totals
+
+
+# Reads the UV coordinates of every loop into a (num_loops, 2) float32 array
+def get_uv_coords(mesh_data, uv_layer=None):
+    if uv_layer is None:
+        uv_layer = mesh_data.uv_layers.active
+    uvs = np.empty(len(mesh_data.loops) * 2, dtype=np.float32)
+    uv_layer.data.foreach_get('uv', uvs)
+    return uvs.reshape(-1, 2)
+
+
+# Calculates the UV area of every polygon of an object in a single batched pass.
+# Returns the total UV area and an array holding the UV area of each polygon.
+# Polygons with less than 3 sides or an invalid (NaN) area count as 0, the same as get_uv_area_for_poly
+def get_uv_areas_for_polys(curr_object):
+    mesh_data = curr_object.data
+    loop_starts, loop_totals = get_polygon_loop_ranges(mesh_data)
+    uvs = get_uv_coords(mesh_data).astype(np.float64)
+
+    poly_areas = math_helpers.polygon_areas_2d(uvs, loop_starts, loop_totals)
+
+    num_small_polys = np.count_nonzero(loop_totals < 3)
+    if num_small_polys > 0:
+        print(f"Warning: {num_small_polys} polygons with less than 3 sides detected, this mesh may produce inaccurate scaling")
+
+    invalid_polys = np.isnan(poly_areas)
+    num_invalid_polys = np.count_nonzero(invalid_polys)
+    if num_invalid_polys > 0:
+        print(f"Warning: {num_invalid_polys} polygons with invalid area detected, this mesh may produce inaccurate scaling")
+        poly_areas[invalid_polys] = 0
+
+    return float(poly_areas.sum()), poly_areas
+
+
 # calculates the total size of the UV area with usage of code
 # from the below source, obtained under the GPL license
 # https://github.com/amb/blender-scripts/blob/master/uv_area.py
 def get_uv_area(curr_object):
-    uv_layer = curr_object.data.uv_layers.active.data
-
-    total_area = 0.0
-    for poly in curr_object.data.polygons:
-        total_area += get_uv_area_for_poly(poly, uv_layer)
-
+    total_area, _ = get_uv_areas_for_polys(curr_object)
     return total_area
 
 
-# calculates the total size of the UV area for a given set of faces
-# with usage of code from the below source, obtained under the GPL license
-# https://github.com/amb/blender-scripts/blob/master/uv_area.py
-def get_uv_area_for_island(curr_object, island_polys):
-    uv_layer = curr_object.data.uv_layers.active.data
+# calculates the total size of the UV area for a given set of faces, from the per polygon areas
+# returned by get_uv_areas_for_polys, so measuring many islands doesn't measure the mesh again each time
+def get_uv_area_for_island(poly_areas, island_polys):
+    island_indices = np.fromiter(island_polys, dtype=np.int64)
+    return float(poly_areas[island_indices].sum())
 
-    total_area = 0.0
-    for face_idx in island_polys:
-        poly = curr_object.data.polygons[face_idx]
-        total_area += get_uv_area_for_poly(poly, uv_layer)
 
-    return total_area
+# Makes sure the mesh has an active UV layer to write to
+def ensure_uv_layer(mesh_data):
+    if mesh_data.uv_layers.active is None:
+        mesh_data.uv_layers.new(name="UVMap")
+    return mesh_data.uv_layers.active
 
 
-def scale_uvs_object(curr_object, scale_factor):
-    uv_layer = curr_object.data.uv_layers.active.data
-    centerOffset = mathutils.Vector(((0.5 * scale_factor), (0.5 * scale_factor)))
-    for poly in curr_object.data.polygons:
-        for loop_idx in poly.loop_indices:
-            uv_layer[loop_idx].uv = (uv_layer[loop_idx].uv * scale_factor) - centerOffset
+# Writes a (num_loops, 2) array of UV coordinates back to the UV layer
+def set_uv_coords(mesh_data, uvs, uv_layer=None):
+    if uv_layer is None:
+        uv_layer = mesh_data.uv_layers.active
+    uv_layer.data.foreach_set('uv', np.ascontiguousarray(uvs, dtype=np.float32).reshape(-1))
 
 
-def scale_uvs_island(curr_object, face_list, scale_factor):
-    uv_layer = curr_object.data.uv_layers.active.data
-    for face_idx in face_list:
-        poly = curr_object.data.polygons[face_idx]
-        for loop_idx in poly.loop_indices:
-            uv_layer[loop_idx].uv = uv_layer[loop_idx].uv * scale_factor
+# Returns the index of the polygon that owns each loop
+def get_loop_polygon_indices(loop_totals):
+    return np.repeat(np.arange(len(loop_totals)), loop_totals)
 
 
+def scale_uvs_object(curr_object, scale_factor):
+    mesh_data = curr_object.data
+    uvs = get_uv_coords(mesh_data)
+    uvs *= scale_factor
+    uvs -= 0.5 * scale_factor
+    set_uv_coords(mesh_data, uvs)
+
+
+# Scales the UVs of the faces in face_mask. face_mask is either a boolean mask with an entry per face,
+# such as island_labels == island_idx, or a list of face indices
+def scale_uvs_island(curr_object, face_mask, scale_factor):
+    mesh_data = curr_object.data
+    face_mask = np.asarray(face_mask)
+    if face_mask.dtype != bool:
+        face_indices = face_mask.astype(np.int64)
+        face_mask = np.zeros(len(mesh_data.polygons), dtype=bool)
+        face_mask[face_indices] = True
+
+    _, loop_totals = get_polygon_loop_ranges(mesh_data)
+    loop_mask = face_mask[get_loop_polygon_indices(loop_totals)]
+
+    uvs = get_uv_coords(mesh_data)
+    island_uvs = uvs[loop_mask]
+    if len(island_uvs) == 0:
+        return
+    # Scale about the center of the island bounds, so the island stays where it was packed
+    center = (island_uvs.min(axis=0) + island_uvs.max(axis=0)) / 2
+    uvs[loop_mask] = (island_uvs - center) * scale_factor + center
+    set_uv_coords(mesh_data, uvs)
+
+
+# Returns the center of the UV bounds of every island, as an array with a row per island.
+# loop_islands holds the island index of each loop
+def get_island_bounds_centers(uvs, loop_islands, num_islands):
+    centers = np.zeros((num_islands, 2), dtype=uvs.dtype)
+    if len(uvs) == 0:
+        return centers
+    # Sort the loops by island so the bounds of every island can be reduced in one go
+    order = np.argsort(loop_islands, kind='stable')
+    sorted_islands = loop_islands[order]
+    starts = np.flatnonzero(np.r_[True, sorted_islands[1:] != sorted_islands[:-1]])
+    sorted_uvs = uvs[order]
+    island_mins = np.minimum.reduceat(sorted_uvs, starts, axis=0)
+    island_maxs = np.maximum.reduceat(sorted_uvs, starts, axis=0)
+    centers[sorted_islands[starts]] = (island_mins + island_maxs) / 2
+    return centers
+
+
+# Scales the UVs of many islands at once, each about the center of its own bounds so packed islands
+# don't drift into each other. island_labels holds the island index of each face,
+# and island_scale_factors the scale factor of each island
+def scale_uvs_islands(curr_object, island_labels, island_scale_factors):
+    mesh_data = curr_object.data
+    _, loop_totals = get_polygon_loop_ranges(mesh_data)
+    loop_islands = np.asarray(island_labels)[get_loop_polygon_indices(loop_totals)]
+    island_scale_factors = np.asarray(island_scale_factors, dtype=np.float32)
+
+    uvs = get_uv_coords(mesh_data)
+    loop_centers = get_island_bounds_centers(uvs, loop_islands, len(island_scale_factors))[loop_islands]
+    uvs = (uvs - loop_centers) * island_scale_factors[loop_islands][:, None] + loop_centers
+    set_uv_coords(mesh_data, uvs)
+
+
+# Projects UVs from the world space position of each face along its dominant normal axis, like a box
+# or triplanar mapping. uv_scale converts world units into UV units, so the texel density is the
+# same everywhere on the mesh without needing to measure and rescale the result
+def box_project_uvs(curr_object, uv_scale):
+    mesh_data = curr_object.data
+    ensure_uv_layer(mesh_data)
+
+    num_verts = len(mesh_data.vertices)
+    num_polys = len(mesh_data.polygons)
+    num_loops = len(mesh_data.loops)
+
+    vert_cos = np.empty(num_verts * 3, dtype=np.float32)
+    mesh_data.vertices.foreach_get('co', vert_cos)
+    poly_normals = np.empty(num_polys * 3, dtype=np.float32)
+    mesh_data.polygons.foreach_get('normal', poly_normals)
+    loop_verts = np.empty(num_loops, dtype=np.int32)
+    mesh_data.loops.foreach_get('vertex_index', loop_verts)
+    _, loop_totals = get_polygon_loop_ranges(mesh_data)
+
+    # Transform positions and normals into world space
+    matrix = np.array(curr_object.matrix_world, dtype=np.float64)
+    rot_scale = matrix[:3, :3]
+    world_cos = vert_cos.reshape(-1, 3) @ rot_scale.T + matrix[:3, 3]
+    world_normals = poly_normals.reshape(-1, 3) @ np.linalg.inv(rot_scale)
+
+    # Pick the axis each face is facing the most, and which side of that axis it faces
+    dominant_axis = np.abs(world_normals).argmax(axis=1)
+    facing_sign = np.where(world_normals[np.arange(num_polys), dominant_axis] >= 0, 1.0, -1.0)
+
+    loop_polys = get_loop_polygon_indices(loop_totals)
+    loop_axis = dominant_axis[loop_polys]
+    loop_sign = facing_sign[loop_polys]
+    loop_cos = world_cos[loop_verts]
+
+    # Flip U on the negative facing sides so textures aren't mirrored
+    uvs = np.empty((num_loops, 2), dtype=np.float64)
+    x_facing = loop_axis == 0
+    y_facing = loop_axis == 1
+    z_facing = loop_axis == 2
+    uvs[x_facing, 0] = loop_cos[x_facing, 1] * loop_sign[x_facing]
+    uvs[x_facing, 1] = loop_cos[x_facing, 2]
+    uvs[y_facing, 0] = -loop_cos[y_facing, 0] * loop_sign[y_facing]
+    uvs[y_facing, 1] = loop_cos[y_facing, 2]
+    uvs[z_facing, 0] = loop_cos[z_facing, 0] * loop_sign[z_facing]
+    uvs[z_facing, 1] = loop_cos[z_facing, 1]
+    uvs *= uv_scale
+
+    set_uv_coords(mesh_data, uvs)
+
+
+# UVs closer than this are treated as the same UV vertex when detecting islands
+UV_CONNECT_PRECISION = 1e-5
+
+
+# Finds the connected components of a graph using a disjoint-set stored in a flat parent array.
+# Every node is hooked to the lowest index node it is connected to, with pointer jumping
+# used to compress the paths between passes. Returns the root node of each node.
+def _union_find_roots(num_nodes, nodes_a, nodes_b):
+    parent = np.arange(num_nodes)
+    while True:
+        roots_a = parent[nodes_a]
+        roots_b = parent[nodes_b]
+        unmerged = roots_a != roots_b
+        if not unmerged.any():
+            return parent
+        low_roots = np.minimum(roots_a[unmerged], roots_b[unmerged])
+        high_roots = np.maximum(roots_a[unmerged], roots_b[unmerged])
+        np.minimum.at(parent, high_roots, low_roots)
+        # Compress paths so every node points directly at its root again
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+# Labels every face of an object with the UV island it belongs to.
+# Two faces are in the same island when they share a mesh edge and both ends of that edge
+# have the same UVs in both faces. This works directly on the mesh data, so it doesn't need
+# edit mode and doesn't change the selection.
+# Returns an array holding the island index of each face, and the number of islands
+def get_uv_island_labels(curr_object: bpy.types.Object):
+    mesh_data: bpy.types.Mesh = curr_object.data
+    num_polys = len(mesh_data.polygons)
+    num_loops = len(mesh_data.loops)
+
+    loop_starts, loop_totals = get_polygon_loop_ranges(mesh_data)
+    loop_verts = np.empty(num_loops, dtype=np.int32)
+    loop_edges = np.empty(num_loops, dtype=np.int32)
+    mesh_data.loops.foreach_get('vertex_index', loop_verts)
+    mesh_data.loops.foreach_get('edge_index', loop_edges)
+    uvs = np.round(get_uv_coords(mesh_data) / UV_CONNECT_PRECISION).astype(np.int64)
+
+    loop_polys = get_loop_polygon_indices(loop_totals)
+    next_loops = math_helpers.next_loop_indices(loop_starts, loop_totals)
+
+    # Each loop covers the edge from its own vertex to the vertex of the next loop.
+    # Order the UVs of both ends by vertex index, so neighbouring faces produce the same key
+    next_verts = loop_verts[next_loops]
+    flip = loop_verts > next_verts
+    uv_first = np.where(flip[:, None], uvs[next_loops], uvs)
+    uv_second = np.where(flip[:, None], uvs, uvs[next_loops])
+    edge_keys = np.column_stack((loop_edges, uv_first, uv_second))
+
+    # Connect the faces of every loop to the first face found with the same edge key
+    _, first_loops, key_indices = np.unique(edge_keys, axis=0, return_index=True, return_inverse=True)
+    key_indices = key_indices.reshape(-1)
+    roots = _union_find_roots(num_polys, loop_polys, loop_polys[first_loops[key_indices]])
+
+    _, island_labels = np.unique(roots, return_inverse=True)
+    island_labels = island_labels.reshape(-1)
+    num_islands = int(island_labels.max()) + 1 if num_polys > 0 else 0
+    return island_labels, num_islands
+
+
+# Returns the UV islands of an object as a list of sets of face indices
 def get_uv_islands(curr_object: bpy.types.Object):
-    # create used_faces set
-    used_faces = set()
-    # create list of face sets
-    islands = []
+    island_labels, num_islands = get_uv_island_labels(curr_object)
 
-    mesh_data: bpy.types.Mesh = curr_object.data
-    uv_layer: bpy.types.MeshUVLoopLayer = mesh_data.uv_layers.active
-    uv_layer_data: bpy.types.MeshUVLoopLayer = mesh_data.uv_layers.active.data
-
-    # Change to edit mode
-    bpy.ops.object.mode_set(mode='EDIT')
-
-    # unselect all
-    bpy.ops.mesh.select_all(action='DESELECT')
-    bpy.ops.uv.select(deselect_all=True)
-
-    # create a bmesh
-    bm: bmesh.types.BMesh = bmesh.from_edit_mesh(mesh_data)
-    bm_uv_layer = bm.loops.layers.uv.verify()
-
-    # for each face
-    for face_idx, face in enumerate(bm.faces):
-        # skip faces that are already in an existing island
-        if face_idx in used_faces:
-            continue
-
-        face.select = True
-
-        # update the mesh in blender with the new selection
-        bmesh.update_edit_mesh(mesh_data)
-        # select linked using blender operator
-        bpy.ops.uv.select_linked()
-
-        # build a set of all selected faces
-        new_island = set()
-        for face_idx2, bm_face2 in enumerate(bm.faces):
-            if bm_face2.select:
-                new_island.add(face_idx2)
-
-        unique_island = True
-        for existing_island in islands:
-            if len(new_island.difference(existing_island)) == 0:
-                print("Existing island - You probably don't want to see this. Something may have gone wrong")
-                unique_island = False
-
-        if unique_island:
-            # store this as an island
-            islands.append(new_island)
-            # add all faces to global used faces set
-            used_faces.update(new_island)
-
-        # unselect faces in uv island
-        face.select = False
-        for selected_face_idx in new_island:
-            bm.faces[selected_face_idx].select = False
+    islands = [set() for _ in range(num_islands)]
+    for face_idx, island_idx in enumerate(island_labels.tolist()):
+        islands[island_idx].add(face_idx)
 
     return islands
 
 
+class UVResultCache:
+    """Least recently used cache of unwrapped UVs, keyed by a fingerprint of the mesh and the unwrap settings.
+    Holds at most max_entries results and max_bytes of UV data"""
+
+    def __init__(self, max_entries=512, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._num_bytes = 0
+
+    def _lookup(self, key):
+        uvs = self._entries.get(key)
+        if uvs is not None:
+            self._entries.move_to_end(key)
+        return uvs
+
+    def get(self, key):
+        uvs = self._lookup(key)
+        if uvs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return uvs
+
+    def store(self, key, uvs):
+        if key in self._entries:
+            self._num_bytes -= self._entries.pop(key).nbytes
+        uvs = np.array(uvs, dtype=np.float32)
+        self._entries[key] = uvs
+        self._num_bytes += uvs.nbytes
+        # Evict the least recently used results
+        while len(self._entries) > self.max_entries or (self._num_bytes > self.max_bytes and len(self._entries) > 1):
+            _, evicted_uvs = self._entries.popitem(last=False)
+            self._num_bytes -= evicted_uvs.nbytes
+
+    def restore(self, curr_object, key):
+        """Writes the cached UVs for key onto the object. Returns False on a cache miss.
+        Cached UVs that don't match the number of loops of the mesh count as a miss"""
+        mesh_data = curr_object.data
+        uvs = self._lookup(key)
+        if uvs is None or len(uvs) != len(mesh_data.loops):
+            self.misses += 1
+            return False
+        self.hits += 1
+        set_uv_coords(mesh_data, uvs, ensure_uv_layer(mesh_data))
+        return True
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._entries.clear()
+        self._num_bytes = 0
+        self.reset_stats()
+
+
+uv_result_cache = UVResultCache()
+
+
 def register():
     pass
 